@@ -0,0 +1,117 @@
+"""An on-disk cache of parsed translation units.
+
+Translation units are saved with TranslationUnit.save after they are parsed,
+and loaded back with TranslationUnit.from_ast_file instead of parsing when
+neither the source file, its compile arguments nor any file it includes have
+changed. Loading a saved AST is much faster than parsing a large C++ file.
+
+Each entry is a saved AST along with a manifest of the files it was built
+from. A file's content hash is only recomputed when its modification time or
+size differ from the manifest.
+"""
+import hashlib
+import json
+import os
+import clang.cindex as ci
+import symbol_store
+
+
+def file_stamp(filename):
+    """Return the (modification time, size) of a file."""
+    st = os.stat(filename)
+    return st.st_mtime, st.st_size
+
+
+class AstCache:
+    """Saved translation units, keyed by source path, arguments and options."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, filename, args, options):
+        """Return the cache key for a file parsed with some arguments."""
+        h = hashlib.sha1(os.path.abspath(filename))
+        h.update('\0')
+        h.update(symbol_store.args_key(args))
+        h.update('\0')
+        h.update(str(options))
+        return h.hexdigest()
+
+    def paths(self, filename, args, options):
+        """Return the paths of the saved AST and manifest for a file."""
+        base = os.path.join(self.directory, self.key(filename, args, options))
+        return base + '.ast', base + '.json'
+
+    def is_current(self, manifest):
+        """Return whether none of the files in a manifest have changed."""
+        for name, (mtime, size, content_hash) in manifest.iteritems():
+            try:
+                if file_stamp(name) == (mtime, size):
+                    continue
+                if symbol_store.file_hash(name) != content_hash:
+                    return False
+            except (IOError, OSError):
+                return False
+        return True
+
+    def load(self, filename, args, options, index):
+        """Load the saved translation unit for a file.
+
+        Return None if there is none, or if anything it was built from has
+        changed.
+        """
+        ast_path, manifest_path = self.paths(filename, args, options)
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        if not self.is_current(manifest):
+            return None
+
+        try:
+            return ci.TranslationUnit.from_ast_file(ast_path, index)
+        except ci.TranslationUnitLoadError:
+            return None
+
+    def save(self, filename, args, options, tu):
+        """Save a freshly parsed translation unit.
+
+        Translation units that cannot be saved, for example because of
+        errors, are not cached.
+        """
+        files = set([filename])
+        for inclusion in tu.get_includes():
+            files.add(inclusion.include.name)
+
+        manifest = dict()
+        try:
+            for name in files:
+                mtime, size = file_stamp(name)
+                manifest[name] = (mtime, size, symbol_store.file_hash(name))
+        except (IOError, OSError):
+            return
+
+        ast_path, manifest_path = self.paths(filename, args, options)
+        self.remove(filename, args, options)
+        try:
+            tu.save(ast_path)
+        except ci.TranslationUnitSaveError:
+            return
+
+        # Write the manifest last, so a partially saved AST is never used.
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.rename(tmp_path, manifest_path)
+
+    def remove(self, filename, args, options):
+        """Remove the saved translation unit for a file, if there is one."""
+        for path in self.paths(filename, args, options):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import unittest
+from ast_cache import AstCache
+from clang_tools import CrossTUIndex
+import clang.cindex as ci
+
+
+class TestAstCache(unittest.TestCase):
+    def setUp(self):
+        if not ci.Config.loaded:
+            ci.Config.set_library_path('clang/lib')
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'ast')
+        self.test_file = 'test/find-defn/test.cpp'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_reload_saved_ast(self):
+        """An unchanged translation unit is loaded from the cache."""
+        index = CrossTUIndex(ast_cache=AstCache(self.cache_dir))
+        index.parse_tu(self.test_file)
+        self.assertNotIn(self.test_file, index.loaded_from_ast)
+
+        index = CrossTUIndex(ast_cache=AstCache(self.cache_dir))
+        index.parse_tu(self.test_file)
+        self.assertIn(self.test_file, index.loaded_from_ast)
+        defn = index.find_definition(self.test_file, line=8, col=2)
+        self.assertIsNotNone(defn)
+        self.assertEqual(defn.displayname, 'in_this_tu()')
+
+    def test_changed_include(self):
+        """A translation unit is parsed again if an include changed."""
+        source_dir = os.path.join(self.tmpdir, 'src')
+        shutil.copytree('test/find-defn', source_dir)
+        test_file = os.path.join(source_dir, 'test.cpp')
+        header = os.path.join(source_dir, 'test.h')
+
+        CrossTUIndex(ast_cache=AstCache(self.cache_dir)).parse_tu(test_file)
+        with open(header, 'a') as f:
+            f.write('\nvoid added();\n')
+
+        index = CrossTUIndex(ast_cache=AstCache(self.cache_dir))
+        index.parse_tu(test_file)
+        self.assertNotIn(test_file, index.loaded_from_ast)
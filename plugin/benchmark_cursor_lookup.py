@@ -0,0 +1,169 @@
+"""Compare the cursors visited to find the cursor at a position.
+
+This generates a C++ file of about 20,000 lines, then looks up the cursor at
+positions spread through it: by collecting every cursor containing each
+position with the original recursive scan over get_children, by collecting
+them in one pass with get_cursors_containing, and by descending to the
+innermost one with get_smallest_cursor_containing. A cursor counts as visited
+when its extent is read, which is what costs a call into libclang.
+
+  python benchmark_cursor_lookup.py [--library-path DIR] [--lines N]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import clang.cindex as ci
+import clang_tools
+from test_util import node
+
+BLOCK = """struct S{0} {{
+  int a;
+  int method(int x) {{ return x + a; }}
+}};
+int f{0}(int x) {{
+  int y = x * 2;
+  if (y > 3) {{ return y + S{0}().method(x); }}
+  return f{1}(y);
+}}
+"""
+
+
+def generate(directory, lines):
+    """Write the file to benchmark on, and return its path."""
+    with open(os.path.join(directory, 'helper.h'), 'w') as f:
+        f.write('struct Helper { int value; };\n')
+    path = os.path.join(directory, 'generated.cpp')
+    blocks = max(1, lines // BLOCK.count('\n'))
+    with open(path, 'w') as f:
+        f.write('int f0(int x) { return x; }\n')
+        for i in xrange(1, blocks + 1):
+            if i == blocks // 2:
+                f.write('#include "helper.h"\n')
+            f.write(BLOCK.format(i, i - 1))
+    return path
+
+
+class CountingExtent(object):
+    """A replacement for Cursor.extent which counts the cursors visited."""
+
+    def __init__(self, extent):
+        self.extent = extent
+        self.visited = 0
+
+    def __get__(self, cursor, cls):
+        if cursor is None:
+            return self
+        if not hasattr(cursor, '_extent'):
+            self.visited += 1
+        return self.extent.__get__(cursor, cls)
+
+
+def scan_cursors_containing(cursor, loc, cursors=None):
+    """The original get_cursors_containing, recursing with get_children."""
+    if cursors is None:
+        cursors = []
+    if not clang_tools.cursor_contains(cursor, loc):
+        return cursors
+    if cursor._kind_id != clang_tools.UNEXPOSED_EXPR:
+        cursors.append(cursor)
+
+    for child in cursor.get_children():
+        scan_cursors_containing(child, loc, cursors)
+
+    return cursors
+
+
+def smallest(cursors):
+    """Return the cursor with the shortest extent, or None."""
+    if not cursors:
+        return None
+    return min(cursors,
+               key=lambda c: c.extent.end.offset - c.extent.start.offset)
+
+
+def old_lookup(tu, loc):
+    return smallest(scan_cursors_containing(tu.cursor, loc))
+
+
+def visit_lookup(tu, loc):
+    return smallest(clang_tools.get_cursors_containing(tu.cursor, loc))
+
+
+def new_lookup(tu, loc):
+    return clang_tools.get_smallest_cursor_containing(tu.cursor, loc)
+
+
+def measure(lookup, tu, positions, counter):
+    """Return the results, cursors visited and seconds taken by a lookup."""
+    counter.visited = 0
+    start = time.time()
+    results = []
+    for filename, line, col in positions:
+        results.append(lookup(tu, tu.get_location(filename, (line, col))))
+    return results, counter.visited, time.time() - start
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark finding the cursor at a position.')
+    parser.add_argument('--library-path', default='',
+                        help='directory containing libclang')
+    parser.add_argument('--lines', type=int, default=20000,
+                        help='approximate length of the generated file')
+    parser.add_argument('--queries', type=int, default=200,
+                        help='number of positions to look up')
+    options = parser.parse_args(argv[1:])
+
+    if options.library_path != '':
+        ci.Config.set_library_path(options.library_path)
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = generate(directory, options.lines)
+        tu = ci.Index.create().parse(path)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        step = max(1, len(lines) // options.queries)
+        positions = []
+        for line in xrange(1, len(lines) + 1, step):
+            text = lines[line - 1]
+            col = text.find('x', len(text) // 2)
+            positions.append((path, line, col + 1 if col >= 0 else 1))
+
+        counter = CountingExtent(ci.Cursor.extent)
+        ci.Cursor.extent = counter
+        try:
+            old, old_visited, old_time = measure(old_lookup, tu, positions,
+                                                 counter)
+            visit, visit_visited, visit_time = measure(visit_lookup, tu,
+                                                       positions, counter)
+            new, new_visited, new_time = measure(new_lookup, tu, positions,
+                                                 counter)
+            # Cursors reached by different walks don't compare equal, so
+            # compare the nodes they refer to.
+            old = [node(c) if c is not None else None for c in old]
+            mismatches = [sum(1 for a, b in zip(old, results)
+                              if a != (node(b) if b is not None else None))
+                          for results in (visit, new)]
+        finally:
+            ci.Cursor.extent = counter.extent
+    finally:
+        shutil.rmtree(directory)
+
+    print('{} lines, {} queries'.format(len(lines), len(positions)))
+    print('get_children scan:              {:>9} cursors visited, '
+          '{:.3f}s'.format(old_visited, old_time))
+    print('get_cursors_containing:         {:>9} cursors visited, '
+          '{:.3f}s, {} results differ'.format(visit_visited, visit_time,
+                                              mismatches[0]))
+    print('get_smallest_cursor_containing: {:>9} cursors visited, '
+          '{:.3f}s, {} results differ'.format(new_visited, new_time,
+                                              mismatches[1]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -64,6 +64,8 @@ call is efficient.
 
 from ctypes import *
 import collections
+import mmap
+import sys
 
 import clang.enumerations
 
@@ -492,8 +494,13 @@ class CursorKind(object):
         CursorKind._kinds[value] = self
         CursorKind._name_map = None
 
-    def from_param(self):
-        return self.value
+    @staticmethod
+    def from_param(kind):
+        # Kind ids are accepted too, so a kind libclang reports that these
+        # bindings don't know can still be passed back to it.
+        if isinstance(kind, (int, long)):
+            return kind
+        return kind.value
 
     @property
     def name(self):
@@ -1294,8 +1301,7 @@ class Cursor(Structure):
         # FIXME: Expose iteration from CIndex, PR6125.
         def visitor(child, parent, children):
             # FIXME: Document this assertion in API.
-            # FIXME: There should just be an isNull method.
-            assert child != conf.lib.clang_getNullCursor()
+            assert not child.is_null()
 
             # Create reference to TU so it isn't GC'd before Cursor.
             child._tu = self._tu
@@ -1306,6 +1312,110 @@ class Cursor(Structure):
             children)
         return iter(children)
 
+    def visit(self, callback):
+        """Visit the descendants of this cursor in preorder, in a single pass.
+
+        callback(cursor, parent) is called for each descendant, and returns
+        2 to visit the cursor's children next, 1 to skip them, or 0 to stop
+        the walk. Nothing is kept between calls, so the memory used doesn't
+        grow with the size of the tree. An exception raised by callback stops
+        the walk and is raised again. Return whether the walk was stopped.
+        """
+        errors = []
+
+        def visitor(child, parent, _):
+            # Create reference to TU so it isn't GC'd before Cursor.
+            child._tu = self._tu
+            parent._tu = self._tu
+            try:
+                return callback(child, parent)
+            except Exception:
+                errors.append(sys.exc_info())
+                return 0 # break
+
+        stopped = conf.lib.clang_visitChildren(
+            self, callbacks['cursor_visit'](visitor), None)
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return bool(stopped)
+
+    def walk_preorder(self, prune=None):
+        """Depth-first preorder walk over the cursor and its descendants.
+
+        This is a generator for the cursors. If prune is given, it's called
+        with each cursor yielded, and the cursor's descendants are skipped if
+        it returns True. Only the children of the cursors on the path to the
+        current one are held, and closing the generator ends the walk.
+
+        A generator can't be resumed from inside libclang's callback, so the
+        children of each cursor are read by get_children, in a
+        clang_visitChildren pass of their own. Use visit to walk the tree in
+        a single pass.
+        """
+        yield self
+        if prune is not None and prune(self):
+            return
+        siblings = [self.get_children()]
+        while siblings:
+            child = next(siblings[-1], None)
+            if child is None:
+                siblings.pop()
+                continue
+            yield child
+            if prune is None or not prune(child):
+                siblings.append(child.get_children())
+
+    def visit_kinds(self, kind_ids, callback, skip_bodies=False):
+        """Call callback(cursor) for each descendant of some kinds, in preorder.
+
+        kind_ids is a collection of CursorKind values, such as a frozenset.
+        It's checked against each cursor's kind id before anything else is
+        done with the cursor, so cursors of other kinds cost very little. If
+        skip_bodies is True, compound statements are not descended into, so
+        neither are function bodies. An exception raised by callback stops
+        the walk and is raised again.
+        """
+        compound_stmt = CursorKind.COMPOUND_STMT.value
+        tu = self._tu
+        errors = []
+
+        def visitor(child, parent, _):
+            kind_id = child._kind_id
+            if kind_id in kind_ids:
+                # Create reference to TU so it isn't GC'd before Cursor.
+                child._tu = tu
+                try:
+                    callback(child)
+                except Exception:
+                    errors.append(sys.exc_info())
+                    return 0 # break
+            if skip_bodies and kind_id == compound_stmt:
+                return 1 # continue
+            return 2 # recurse
+
+        conf.lib.clang_visitChildren(self, callbacks['cursor_visit'](visitor),
+            None)
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+
+    def find_descendants(self, kind_ids, skip_bodies=False):
+        """Return the descendants of this cursor of some kinds, in preorder.
+
+        This takes the same arguments as visit_kinds.
+        """
+        found = []
+        self.visit_kinds(kind_ids, found.append, skip_bodies)
+        return found
+
+    def is_null(self):
+        """Return whether this is the null cursor.
+
+        Unlike comparing with clang_getNullCursor, this calls nothing in
+        libclang.
+        """
+        return (self._kind_id == CursorKind.INVALID_FILE.value and
+                not self.data[0] and not self.data[1] and not self.data[2])
+
     def get_tokens(self):
         """Obtain Token instances formulating that compose this Cursor.
 
@@ -1317,8 +1427,7 @@ class Cursor(Structure):
     @staticmethod
     def from_result(res, fn, args):
         assert isinstance(res, Cursor)
-        # FIXME: There should just be an isNull method.
-        if res == conf.lib.clang_getNullCursor():
+        if res.is_null():
             return None
 
         # Store a reference to the TU in the Python object so it won't get GC'd
@@ -1341,7 +1450,7 @@ class Cursor(Structure):
     @staticmethod
     def from_cursor_result(res, fn, args):
         assert isinstance(res, Cursor)
-        if res == conf.lib.clang_getNullCursor():
+        if res.is_null():
             return None
 
         res._tu = args[0]._tu
@@ -1645,6 +1754,126 @@ class _CXUnsavedFile(Structure):
     """Helper for passing unsaved file arguments."""
     _fields_ = [("name", c_char_p), ("contents", c_char_p), ('length', c_ulong)]
 
+_buffer_address = pythonapi.PyObject_AsReadBuffer
+_buffer_address.argtypes = [py_object, POINTER(c_void_p), POINTER(c_ssize_t)]
+_buffer_address.restype = c_int
+
+class UnsavedFiles(object):
+    """A registry of in-memory file contents to parse instead of the files.
+
+    The contents are passed to libclang directly from the memory of the
+    objects holding them, without being copied, if they support the buffer
+    interface. This includes strings, mmap objects and bytearrays. Other
+    objects, such as memoryviews and file objects, are copied once when they
+    are set.
+
+    The array passed to libclang is kept between calls, and only the entries
+    whose contents changed are updated. Mutable buffers, such as bytearrays
+    and mmap objects, can be changed in place or reallocated between calls,
+    so their entries are filled again each time the array is passed.
+    """
+
+    def __init__(self, unsaved_files=None):
+        # The name, source object and slot in the array of each file.
+        self.names = []
+        self.sources = []
+        self.slots = {}
+        self.array = None
+        if unsaved_files is not None:
+            self.update(unsaved_files)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.slots
+
+    def __iter__(self):
+        return iter(zip(self.names, self.sources))
+
+    def set(self, name, contents):
+        """Set the contents of a file."""
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        slot = self.slots.get(name)
+        if (slot is not None and self.sources[slot] is contents and
+                isinstance(contents, str)):
+            return
+
+        if hasattr(contents, "read") and not isinstance(contents, mmap.mmap):
+            contents = contents.read()
+        if isinstance(contents, unicode):
+            contents = contents.encode('utf-8')
+        elif isinstance(contents, memoryview):
+            contents = contents.tobytes()
+
+        if slot is None:
+            slot = len(self.names)
+            self.names.append(name)
+            self.sources.append(contents)
+            self.slots[name] = slot
+            self.array = None
+        else:
+            self.sources[slot] = contents
+            if self.array is not None:
+                self._fill(slot)
+
+    def remove(self, name):
+        """Stop substituting the contents of a file."""
+        slot = self.slots.pop(name)
+        del self.names[slot]
+        del self.sources[slot]
+        for i in xrange(slot, len(self.names)):
+            self.slots[self.names[i]] = i
+        self.array = None
+
+    def update(self, unsaved_files):
+        """Make the registry hold exactly the given (name, contents) pairs.
+
+        Files whose contents are the same strings as before are left alone.
+        """
+        names = set()
+        for name, contents in unsaved_files:
+            if isinstance(name, unicode):
+                name = name.encode('utf-8')
+            self.set(name, contents)
+            names.add(name)
+        for name in list(self.names):
+            if name not in names:
+                self.remove(name)
+
+    def _fill(self, slot):
+        address = c_void_p()
+        length = c_ssize_t()
+        _buffer_address(self.sources[slot], byref(address), byref(length))
+        entry = self.array[slot]
+        entry.name = self.names[slot]
+        entry.contents = cast(address, c_char_p)
+        entry.length = length.value
+
+    def from_param(self):
+        """Return the array of _CXUnsavedFile to pass to libclang."""
+        if not self.names:
+            return None
+        if self.array is None:
+            self.array = (_CXUnsavedFile * len(self.names))()
+            for slot in xrange(len(self.names)):
+                self._fill(slot)
+        else:
+            for slot, contents in enumerate(self.sources):
+                if not isinstance(contents, str):
+                    self._fill(slot)
+        return self.array
+
+class _CXTUResourceUsageEntry(Structure):
+    """Helper for reading the resource usage of a translation unit."""
+    _fields_ = [("kind", c_int), ("amount", c_ulong)]
+
+class CXTUResourceUsage(Structure):
+    """The memory used by a translation unit, broken down by kind."""
+    _fields_ = [("data", c_void_p), ("numEntries", c_uint),
+                ("entries", POINTER(_CXTUResourceUsageEntry))]
+
 class CompletionChunk:
     class Kind:
         def __init__(self, name):
@@ -1859,7 +2088,9 @@ class Index(ClangObject):
         In-memory contents for files can be provided by passing a list of pairs
         to as unsaved_files, the first item should be the filenames to be mapped
         and the second should be the contents to be substituted for the
-        file. The contents may be passed as strings or file objects.
+        file. The contents may be passed as strings, buffers such as mmap
+        objects, or file objects. An UnsavedFiles may be passed instead of a
+        list.
 
         If an error was encountered during parsing, a TranslationUnitLoadError
         will be raised.
@@ -1906,6 +2137,10 @@ class TranslationUnit(ClangObject):
     # into the set of code completions returned from this translation unit.
     PARSE_INCLUDE_BRIEF_COMMENTS_IN_CODE_COMPLETION = 128
 
+    # Used together with PARSE_PRECOMPILED_PREAMBLE to build the preamble
+    # while parsing, rather than on the first reparse.
+    PARSE_CREATE_PREAMBLE_ON_FIRST_PARSE = 256
+
     @classmethod
     def from_source(cls, filename, args=None, unsaved_files=None, options=0,
                     index=None):
@@ -1921,9 +2156,10 @@ class TranslationUnit(ClangObject):
         In-memory file content can be provided via unsaved_files. This is an
         iterable of 2-tuples. The first element is the str filename. The
         second element defines the content. Content can be provided as str
-        source code or as file objects (anything with a read() method). If
-        a file object is being used, content will be read until EOF and the
-        read cursor will not be reset to its original position.
+        source code, as buffers such as mmap objects, or as file objects
+        (anything with a read() method). If a file object is being used,
+        content will be read until EOF and the read cursor will not be reset
+        to its original position. An UnsavedFiles may be passed instead.
 
         options is a bitwise or of TranslationUnit.PARSE_XXX flags which will
         control parsing behavior.
@@ -1961,25 +2197,21 @@ class TranslationUnit(ClangObject):
         if len(args) > 0:
             args_array = (c_char_p * len(args))(* args)
 
-        unsaved_array = None
-        if len(unsaved_files) > 0:
-            unsaved_array = (_CXUnsavedFile * len(unsaved_files))()
-            for i, (name, contents) in enumerate(unsaved_files):
-                if hasattr(contents, "read"):
-                    contents = contents.read()
-
-                unsaved_array[i].name = name
-                unsaved_array[i].contents = contents
-                unsaved_array[i].length = len(contents)
+        owned = not isinstance(unsaved_files, UnsavedFiles)
+        if owned:
+            unsaved_files = UnsavedFiles(unsaved_files)
 
         ptr = conf.lib.clang_parseTranslationUnit(index, filename, args_array,
-                                    len(args), unsaved_array,
+                                    len(args), unsaved_files.from_param(),
                                     len(unsaved_files), options)
 
         if ptr is None:
             raise TranslationUnitLoadError("Error parsing translation unit.")
 
-        return cls(ptr, index=index)
+        tu = cls(ptr, index=index)
+        if owned:
+            tu.unsaved_files = unsaved_files
+        return tu
 
     @classmethod
     def from_ast_file(cls, filename, index=None):
@@ -2012,10 +2244,22 @@ class TranslationUnit(ClangObject):
         assert isinstance(index, Index)
 
         ClangObject.__init__(self, ptr)
+        # Keep the index alive for as long as the translation unit.
+        self.index = index
+        # The unsaved files last passed to libclang, kept so their array can
+        # be reused.
+        self.unsaved_files = UnsavedFiles()
 
     def __del__(self):
         conf.lib.clang_disposeTranslationUnit(self)
 
+    def _unsaved_files(self, unsaved_files):
+        """Return an UnsavedFiles holding the given unsaved files."""
+        if isinstance(unsaved_files, UnsavedFiles):
+            return unsaved_files
+        self.unsaved_files.update(unsaved_files or [])
+        return self.unsaved_files
+
     @property
     def cursor(self):
         """Retrieve the cursor that represents the given translation unit."""
@@ -2046,6 +2290,23 @@ class TranslationUnit(ClangObject):
 
         return iter(includes)
 
+    def get_resource_usage(self):
+        """Return the memory used by this translation unit.
+
+        The result is a dict of the number of bytes used, keyed by the name of
+        each kind of resource.
+        """
+        usage = conf.lib.clang_getCXTUResourceUsage(self)
+        try:
+            result = {}
+            for i in xrange(usage.numEntries):
+                entry = usage.entries[i]
+                name = conf.lib.clang_getTUResourceUsageName(entry.kind)
+                result[name] = result.get(name, 0) + int(entry.amount)
+        finally:
+            conf.lib.clang_disposeCXTUResourceUsage(usage)
+        return result
+
     def get_file(self, filename):
         """Obtain a File from this translation unit."""
 
@@ -2127,34 +2388,32 @@ class TranslationUnit(ClangObject):
 
         return DiagIterator(self)
 
-    def reparse(self, unsaved_files=None, options=0):
+    def reparse(self, unsaved_files=None, options=None):
         """
         Reparse an already parsed translation unit.
 
         In-memory contents for files can be provided by passing a list of pairs
         as unsaved_files, the first items should be the filenames to be mapped
         and the second should be the contents to be substituted for the
-        file. The contents may be passed as strings or file objects.
+        file. The contents may be passed as strings, buffers such as mmap
+        objects, or file objects. An UnsavedFiles may be passed instead of a
+        list.
+
+        If options is not given, the default reparse options for this
+        translation unit are used, which keep any precompiled preamble.
+
+        If an error occurs, a TranslationUnitLoadError is raised, and the
+        translation unit may no longer be used.
         """
-        if unsaved_files is None:
-            unsaved_files = []
+        unsaved_files = self._unsaved_files(unsaved_files)
 
-        unsaved_files_array = 0
-        if len(unsaved_files):
-            unsaved_files_array = (_CXUnsavedFile * len(unsaved_files))()
-            for i,(name,value) in enumerate(unsaved_files):
-                if not isinstance(value, str):
-                    # FIXME: It would be great to support an efficient version
-                    # of this, one day.
-                    value = value.read()
-                    print value
-                if not isinstance(value, str):
-                    raise TypeError,'Unexpected unsaved file contents.'
-                unsaved_files_array[i].name = name
-                unsaved_files_array[i].contents = value
-                unsaved_files_array[i].length = len(value)
-        ptr = conf.lib.clang_reparseTranslationUnit(self, len(unsaved_files),
-                unsaved_files_array, options)
+        if options is None:
+            options = conf.lib.clang_defaultReparseOptions(self)
+
+        result = conf.lib.clang_reparseTranslationUnit(self,
+                len(unsaved_files), unsaved_files.from_param(), options)
+        if result != 0:
+            raise TranslationUnitLoadError("Error reparsing translation unit.")
 
     def save(self, filename):
         """Saves the TranslationUnit to a file.
@@ -2187,7 +2446,9 @@ class TranslationUnit(ClangObject):
         In-memory contents for files can be provided by passing a list of pairs
         as unsaved_files, the first items should be the filenames to be mapped
         and the second should be the contents to be substituted for the
-        file. The contents may be passed as strings or file objects.
+        file. The contents may be passed as strings, buffers such as mmap
+        objects, or file objects. An UnsavedFiles may be passed instead of a
+        list.
         """
         options = 0
 
@@ -2200,25 +2461,9 @@ class TranslationUnit(ClangObject):
         if include_brief_comments:
             options += 4
 
-        if unsaved_files is None:
-            unsaved_files = []
-
-        unsaved_files_array = 0
-        if len(unsaved_files):
-            unsaved_files_array = (_CXUnsavedFile * len(unsaved_files))()
-            for i,(name,value) in enumerate(unsaved_files):
-                if not isinstance(value, str):
-                    # FIXME: It would be great to support an efficient version
-                    # of this, one day.
-                    value = value.read()
-                    print value
-                if not isinstance(value, str):
-                    raise TypeError,'Unexpected unsaved file contents.'
-                unsaved_files_array[i].name = name
-                unsaved_files_array[i].contents = value
-                unsaved_files_array[i].length = len(value)
+        unsaved_files = self._unsaved_files(unsaved_files)
         ptr = conf.lib.clang_codeCompleteAt(self, path, line, column,
-                unsaved_files_array, len(unsaved_files), options)
+                unsaved_files.from_param(), len(unsaved_files), options)
         if ptr:
             return CodeCompletionResults(ptr)
         return None
@@ -2329,6 +2574,11 @@ class CompileCommand(object):
         """Get the working directory for this CompileCommand"""
         return conf.lib.clang_CompileCommand_getDirectory(self.cmd)
 
+    @property
+    def filename(self):
+        """Get the source file this CompileCommand compiles"""
+        return conf.lib.clang_CompileCommand_getFilename(self.cmd)
+
     @property
     def arguments(self):
         """
@@ -2405,6 +2655,13 @@ class CompilationDatabase(ClangObject):
         return conf.lib.clang_CompilationDatabase_getCompileCommands(self,
                                                                      filename)
 
+    def getAllCompileCommands(self):
+        """
+        Get an iterable object providing all the CompileCommands available from
+        the database.
+        """
+        return conf.lib.clang_CompilationDatabase_getAllCompileCommands(self)
+
 class Token(Structure):
     """Represents a single token from the preprocessor.
 
@@ -2448,6 +2705,7 @@ class Token(Structure):
         cursor = Cursor()
 
         conf.lib.clang_annotateTokens(self._tu, byref(self), 1, byref(cursor))
+        cursor._tu = self._tu
 
         return cursor
 
@@ -2471,6 +2729,11 @@ functionList = [
    c_object_p,
    CompilationDatabase.from_result),
 
+  ("clang_CompilationDatabase_getAllCompileCommands",
+   [c_object_p],
+   c_object_p,
+   CompileCommands.from_result),
+
   ("clang_CompilationDatabase_getCompileCommands",
    [c_object_p, c_char_p],
    c_object_p,
@@ -2497,6 +2760,11 @@ functionList = [
    _CXString,
    _CXString.from_result),
 
+  ("clang_CompileCommand_getFilename",
+   [c_object_p],
+   _CXString,
+   _CXString.from_result),
+
   ("clang_CompileCommand_getNumArgs",
    [c_object_p],
    c_uint),
@@ -2529,6 +2797,10 @@ functionList = [
    [Cursor],
    bool),
 
+  ("clang_defaultReparseOptions",
+   [TranslationUnit],
+   c_uint),
+
   ("clang_defaultSaveOptions",
    [TranslationUnit],
    c_uint),
@@ -2536,8 +2808,8 @@ functionList = [
   ("clang_disposeCodeCompleteResults",
    [CodeCompletionResults]),
 
-# ("clang_disposeCXTUResourceUsage",
-#  [CXTUResourceUsage]),
+  ("clang_disposeCXTUResourceUsage",
+   [CXTUResourceUsage]),
 
   ("clang_disposeDiagnostic",
    [Diagnostic]),
@@ -2678,9 +2950,9 @@ functionList = [
    _CXString,
    _CXString.from_result),
 
-# ("clang_getCXTUResourceUsage",
-#  [TranslationUnit],
-#  CXTUResourceUsage),
+  ("clang_getCXTUResourceUsage",
+   [TranslationUnit],
+   CXTUResourceUsage),
 
   ("clang_getCXXAccessSpecifier",
    [Cursor],
@@ -3161,4 +3433,5 @@ __all__ = [
     'TranslationUnit',
     'TypeKind',
     'Type',
+    'UnsavedFiles',
 ]
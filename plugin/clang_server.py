@@ -0,0 +1,357 @@
+"""A standalone process hosting a CrossTUIndex for an editor to talk to.
+
+Parsing in a separate process keeps the editor responsive however long clang
+takes, and a crash in libclang only takes down the server. When it listens on
+a Unix socket, the server also outlives the editor, so its parsed translation
+units are still loaded when the editor is started again. Several editors on
+the same project can share one server, and with it a single copy of each
+translation unit and of the symbol index.
+
+The protocol is one JSON object per line in each direction. Requests are
+
+  {"id": 1, "method": "definition", "params": {"filename": ..., ...}}
+
+and each gets a response with the same id, holding either a "result" or an
+"error" message. The methods are:
+
+  open        filename, contents: a buffer was opened, and is now the one
+              being edited. contents is null unless the buffer is modified
+              relative to its file. Each client should close a buffer as many
+              times as it opened it.
+  activate    filename: an open buffer is now the one being edited.
+  change      filename, contents: a buffer changed or was written.
+  close       filename: a buffer was closed.
+  definition  filename, line, column: find the definition of the symbol at a
+              position. The result is null, or has filename, line and column.
+  stats       statistics about the index.
+  memory_usage
+              the bytes used by each loaded translation unit in "files", and
+              in total by each kind of resource in "kinds". Translation units
+              being reparsed aren't measured, and are listed in "reparsing".
+  includers   filename: the translation units which include a file.
+
+The files a client opened are closed when it disconnects.
+
+For example, to serve on stdin and stdout:
+
+  python clang_server.py --build-dir build/
+"""
+import SocketServer
+import argparse
+import collections
+import errno
+import fcntl
+import itertools
+import json
+import os
+import socket
+import stat
+import sys
+import threading
+import clang.cindex as ci
+import clang_tools
+from clang_tools import location_of
+
+
+class ProtocolError(Exception):
+    """Represents a malformed request."""
+    pass
+
+
+class SocketInUse(Exception):
+    """Another server is already listening on the socket."""
+    pass
+
+
+class ClangServer:
+    """Answer requests from editors using a CrossTUIndex.
+
+    Every client shares the same index, and so the same translation units.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.index.pinned = self.pinned_files
+        # libclang isn't safe to use from several threads at once.
+        self.lock = threading.Lock()
+        # How many times each client opened each file, and how many clients
+        # have each file open in total.
+        self.client_ids = itertools.count(1)
+        self.clients = dict()
+        self.open_files = collections.Counter()
+        # The contents of the files modified relative to what's on disk, and
+        # the client each one came from.
+        self.unsaved_files = dict()
+        self.unsaved_owners = dict()
+        self.methods = {
+            'open': self.open,
+            'activate': self.activate,
+            'change': self.change,
+            'close': self.close,
+            'definition': self.definition,
+            'stats': self.stats,
+            'memory_usage': self.memory_usage,
+            'includers': self.includers,
+        }
+
+    def pinned_files(self):
+        """Return the files whose translation units must stay loaded."""
+        return list(self.open_files)
+
+    def connect(self):
+        """Register a new client, and return its id."""
+        with self.lock:
+            client = next(self.client_ids)
+            self.clients[client] = collections.Counter()
+            return client
+
+    def disconnect(self, client):
+        """Close every file a client left open."""
+        with self.lock:
+            open_files = self.clients.pop(client)
+            for filename, count in open_files.iteritems():
+                self.release(client, filename, count)
+
+    def handle(self, request, client=None):
+        """Run a request from a client, and return the response to send."""
+        response = {'id': request.get('id')}
+        try:
+            method = self.methods.get(request.get('method'))
+            if method is None:
+                raise ProtocolError('Unknown method {}'.format(
+                    request.get('method')))
+            params = request.get('params') or {}
+            with self.lock:
+                response['result'] = method(client, **params)
+        except Exception, e:
+            response['error'] = str(e)
+        return response
+
+    def handle_line(self, line, client=None):
+        """Run a request read from a line, and return the response line."""
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('Requests must be objects')
+        except ValueError, e:
+            return json.dumps({'id': None, 'error': str(e)})
+        return json.dumps(self.handle(request, client))
+
+    def set_contents(self, client, filename, contents):
+        """Record the unsaved contents of a file, or None if it's saved."""
+        if contents is None:
+            self.unsaved_files.pop(filename, None)
+            self.unsaved_owners.pop(filename, None)
+        else:
+            if isinstance(contents, unicode):
+                contents = contents.encode('utf-8')
+            self.unsaved_files[filename] = contents
+            self.unsaved_owners[filename] = client
+
+    def release(self, client, filename, count=1):
+        """Drop references a client held to a file."""
+        self.open_files[filename] -= count
+        if self.open_files[filename] <= 0:
+            del self.open_files[filename]
+        if (self.unsaved_owners.get(filename) == client and
+                (client is None or client not in self.clients or
+                 not self.clients[client][filename])):
+            # Anything including it now sees the file on disk.
+            self.set_contents(client, filename, None)
+            self.reparse_changed(filename)
+
+    def reparse_changed(self, filename):
+        """Reparse the translation units affected by a changed file.
+
+        Return the reparsed translation units.
+        """
+        return self.index.reparse_tus(self.index.invalidate([filename]),
+                                      self.unsaved_files.items())
+
+    def open(self, client, filename, contents=None):
+        """Load the translation unit of a file being edited."""
+        if client in self.clients:
+            self.clients[client][filename] += 1
+        self.open_files[filename] += 1
+        self.set_contents(client, filename, contents)
+        self.index.set_active(filename, self.unsaved_files.items())
+        self.index.get_or_parse_tu(filename)
+        if contents is not None:
+            self.reparse_changed(filename)
+        return True
+
+    def activate(self, client, filename):
+        """Make an open file the one being edited."""
+        self.index.set_active(filename, self.unsaved_files.items())
+        self.index.get_or_parse_tu(filename)
+        return True
+
+    def change(self, client, filename, contents=None):
+        """Reparse what's affected by a changed or written file."""
+        self.set_contents(client, filename, contents)
+        return self.reparse_changed(filename)
+
+    def close(self, client, filename):
+        """Stop tracking a file closed in the editor."""
+        if client in self.clients:
+            if not self.clients[client][filename]:
+                raise ProtocolError('{} is not open'.format(filename))
+            self.clients[client][filename] -= 1
+            if not self.clients[client][filename]:
+                del self.clients[client][filename]
+        self.release(client, filename)
+        return True
+
+    def definition(self, client, filename, line, column):
+        """Find the definition of the symbol at a position."""
+        defn = self.index.find_definition(filename, line, column)
+        if defn is None:
+            return None
+        target_file, target_line, target_column = location_of(defn)
+        return {'filename': os.path.abspath(target_file),
+                'line': target_line,
+                'column': target_column}
+
+    def stats(self, client):
+        """Return statistics about the index."""
+        stats = self.index.stats()
+        stats['clients'] = len(self.clients)
+        stats['open_files'] = len(self.open_files)
+        return stats
+
+    def memory_usage(self, client):
+        """Return the memory used by the loaded translation units."""
+        usage = self.index.memory_usage()
+        return {'files': dict((filename, sum(kinds.itervalues()))
+                              for filename, kinds in usage.iteritems()),
+                'kinds': self.index.total_memory_usage(),
+                'reparsing': sorted(self.index.jobs)}
+
+    def includers(self, client, filename):
+        """Return the translation units which include a file."""
+        return sorted(self.index.including_tus(filename))
+
+
+def serve_stream(server, infile, outfile):
+    """Answer one client's requests read from infile until it's closed."""
+    client = server.connect()
+    try:
+        for line in iter(infile.readline, ''):
+            if not line.strip():
+                continue
+            outfile.write(server.handle_line(line, client) + '\n')
+            outfile.flush()
+    finally:
+        server.disconnect(client)
+
+
+class StreamHandler(SocketServer.StreamRequestHandler):
+    """Answer the requests of one client connected to the socket."""
+
+    def handle(self):
+        serve_stream(self.server.clang_server, self.rfile, self.wfile)
+
+
+def make_private_directory(directory):
+    """Create a directory only the current user can use, if it's missing.
+
+    Raise OSError if it exists and someone else could create files in it,
+    and so listen on a socket there before this server does.
+    """
+    try:
+        os.mkdir(directory, 0700)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+    info = os.lstat(directory)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or
+            info.st_mode & 0077):
+        raise OSError(errno.EPERM, 'Not a private directory', directory)
+
+
+def socket_in_use(path):
+    """Return whether a server is accepting connections on a socket."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except socket.error, e:
+        if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+            return False
+        raise
+    finally:
+        client.close()
+    return True
+
+
+class SocketListener(SocketServer.ThreadingMixIn,
+                     SocketServer.UnixStreamServer):
+    """Accept clients on a Unix socket, each on its own thread.
+
+    The socket must be in a directory only the current user can use, which
+    is created if it's missing. Raise SocketInUse if another server is
+    already listening on it.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, clang_server):
+        make_private_directory(os.path.dirname(os.path.abspath(path)))
+        # Servers started at the same time take turns, so only the first
+        # listens and the others find it running.
+        with open(path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.lexists(path):
+                if socket_in_use(path):
+                    raise SocketInUse(path)
+                # Left behind by a server that didn't exit cleanly.
+                os.remove(path)
+            SocketServer.UnixStreamServer.__init__(self, path, StreamHandler)
+        self.clang_server = clang_server
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Serve clang tools requests over stdio or a socket.')
+    parser.add_argument('--library-path', default='',
+                        help='directory containing libclang')
+    parser.add_argument('--index-path', default='',
+                        help='symbol database to keep between sessions')
+    parser.add_argument('--snapshot-path', default='',
+                        help='read-only snapshot of definitions')
+    parser.add_argument('--build-dir', default='',
+                        help='directory containing compile_commands.json')
+    parser.add_argument('--ast-cache-dir', default='',
+                        help='directory in which to save parsed files')
+    parser.add_argument('--max-tus', type=int, default=0,
+                        help='most translation units to keep loaded')
+    parser.add_argument('--max-memory-mb', type=int, default=0,
+                        help='most memory for loaded translation units')
+    parser.add_argument('--parse-threads', type=int, default=0,
+                        help='threads to parse on, defaulting to one per CPU')
+    parser.add_argument('--socket', default='',
+                        help='Unix socket to listen on, instead of stdio')
+    options = parser.parse_args(argv[1:])
+
+    if options.library_path != '':
+        ci.Config.set_library_path(options.library_path)
+    server = ClangServer(clang_tools.create_index(
+        options.index_path, options.snapshot_path, options.build_dir,
+        options.ast_cache_dir, options.max_tus, options.max_memory_mb,
+        parse_threads=options.parse_threads))
+
+    if options.socket == '':
+        # Keep anything else printed out of the responses.
+        output = sys.stdout
+        sys.stdout = sys.stderr
+        serve_stream(server, sys.stdin, output)
+    else:
+        try:
+            listener = SocketListener(options.socket, server)
+        except SocketInUse:
+            # Clients connect to the server already running.
+            return 0
+        listener.serve_forever()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,147 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+from StringIO import StringIO
+from clang_server import ClangServer, SocketInUse, SocketListener
+from clang_server import serve_stream
+from clang_tools import CrossTUIndex
+import clang.cindex as ci
+
+
+class TestClangServer(unittest.TestCase):
+    def setUp(self):
+        if not ci.Config.loaded:
+            ci.Config.set_library_path('clang/lib')
+        self.server = ClangServer(CrossTUIndex())
+        self.test_file = 'test/find-defn/test.cpp'
+        self.print_file = 'test/find-defn/print.cpp'
+
+    def request(self, method, **params):
+        return self.server.handle({'id': 1, 'method': method,
+                                   'params': params})
+
+    def test_definition_in_other_tu(self):
+        self.assertEqual(self.request('open', filename=self.print_file),
+                         {'id': 1, 'result': True})
+        self.request('open', filename=self.test_file)
+        response = self.request('definition', filename=self.test_file,
+                                line=7, column=9)
+        self.assertEqual(response['result'],
+                         {'filename': os.path.abspath(self.print_file),
+                          'line': 4, 'column': 6})
+
+    def test_change_uses_unsaved_contents(self):
+        self.request('open', filename=self.test_file)
+        with open(self.test_file) as f:
+            contents = f.read()
+        contents = contents.replace('in_this_tu', 'renamed_in_this_tu')
+        response = self.request('change', filename=self.test_file,
+                                contents=contents)
+        self.assertEqual(response['result'], [self.test_file])
+        tu = self.server.index.tus[self.test_file]
+        self.assertIn('renamed_in_this_tu',
+                      [c.spelling for c in tu.cursor.get_children()])
+
+    def test_memory_usage(self):
+        self.request('open', filename=self.test_file)
+        result = self.request('memory_usage')['result']
+        self.assertEqual(list(result['files']), [self.test_file])
+        self.assertEqual(sum(result['kinds'].itervalues()),
+                         result['files'][self.test_file])
+        self.assertEqual(result['reparsing'], [])
+
+    def test_includers(self):
+        self.request('open', filename=self.test_file)
+        header = os.path.abspath('test/find-defn/test.h')
+        response = self.request('includers', filename=header)
+        self.assertEqual(response['result'], [self.test_file])
+
+    def test_stream(self):
+        """Requests are answered one line each, including bad ones."""
+        requests = StringIO('\n'.join([
+            json.dumps({'id': 1, 'method': 'stats'}),
+            json.dumps({'id': 2, 'method': 'nonexistent'}),
+            'not json',
+        ]) + '\n')
+        responses = StringIO()
+        serve_stream(self.server, requests, responses)
+        lines = [json.loads(line)
+                 for line in responses.getvalue().splitlines()]
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0]['result']['tus'], 0)
+        self.assertEqual(lines[1]['id'], 2)
+        self.assertIn('error', lines[1])
+        self.assertIn('error', lines[2])
+
+    def test_shared_between_clients(self):
+        """Files stay open until every client that opened them closes them."""
+        first = self.server.connect()
+        second = self.server.connect()
+        request = {'id': 1, 'method': 'open',
+                   'params': {'filename': self.test_file}}
+        self.server.handle(request, first)
+        self.server.handle(request, second)
+        self.server.handle(request, second)
+        tu = self.server.index.tus[self.test_file]
+        self.assertEqual(self.server.open_files[self.test_file], 3)
+
+        self.server.disconnect(second)
+        self.assertEqual(self.server.pinned_files(), [self.test_file])
+        self.assertIs(self.server.index.tus[self.test_file], tu)
+        response = self.server.handle(
+            {'id': 2, 'method': 'close',
+             'params': {'filename': self.print_file}}, first)
+        self.assertIn('error', response)
+
+        self.server.handle({'id': 3, 'method': 'close',
+                            'params': {'filename': self.test_file}}, first)
+        self.assertEqual(self.server.pinned_files(), [])
+
+    def test_unsaved_contents_dropped_on_disconnect(self):
+        client = self.server.connect()
+        self.server.handle({'id': 1, 'method': 'open',
+                            'params': {'filename': self.test_file,
+                                       'contents': 'int x;'}}, client)
+        self.assertIn(self.test_file, self.server.unsaved_files)
+        self.server.disconnect(client)
+        self.assertNotIn(self.test_file, self.server.unsaved_files)
+        tu = self.server.index.tus[self.test_file]
+        self.assertIn('in_this_tu',
+                      [c.spelling for c in tu.cursor.get_children()])
+
+
+class TestSocketListener(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'server', 'test.sock')
+        self.server = ClangServer(CrossTUIndex())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_private_directory(self):
+        listener = SocketListener(self.path, self.server)
+        listener.server_close()
+        self.assertEqual(os.stat(os.path.dirname(self.path)).st_mode & 0777,
+                         0700)
+
+    def test_shared_directory_refused(self):
+        os.chmod(self.directory, 0777)
+        self.path = os.path.join(self.directory, 'test.sock')
+        self.assertRaises(OSError, SocketListener, self.path, self.server)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_only_stale_socket_replaced(self):
+        listener = SocketListener(self.path, self.server)
+        self.assertRaises(SocketInUse, SocketListener, self.path, self.server)
+        listener.server_close()
+
+        # Nothing listens on the socket left behind.
+        listener = SocketListener(self.path, self.server)
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(self.path)
+        client.close()
+        listener.server_close()
@@ -4,6 +4,20 @@ For example, the logic for finding a definition of a symbol belongs here, but
 the code for navigating there in the editor does not.
 """
 import clang.cindex as ci
+import collections
+import os.path
+import re
+import symbol_store
+import threading
+import time
+import zlib
+from ast_cache import AstCache
+from compile_flags import CompileFlags
+from cursor_index import CursorIndex
+from cursor_table import CursorTable
+from flat_index import FlatIndex
+from include_graph import IncludeGraph
+from parse_pool import JobCancelled, ParsePool, wait_for_any
 
 index = None
 tus = dict()
@@ -25,6 +39,11 @@ def print_warning(message):
     print(message)
 
 
+# Kinds are compared by id, as Cursor.kind raises ValueError for kinds these
+# bindings don't know, which newer versions of libclang return.
+UNEXPOSED_EXPR = ci.CursorKind.UNEXPOSED_EXPR.value
+
+
 def cursor_contains(cursor, loc):
     """Return whether the cursor extends around the location."""
     start = cursor.extent.start
@@ -42,7 +61,7 @@ def cursor_contains(cursor, loc):
         return False
     if end.line < loc.line:
         return False
-    if end.line == loc.line and end.column < end.column:
+    if end.line == loc.line and end.column < loc.column:
         return False
     return True
 
@@ -51,35 +70,214 @@ def get_cursors_containing(cursor, loc, cursors=None):
     """Return a list of child cursors that extend around the location.
 
     If cursors (a list) is passed in, cursors will be appended to it.
-    Unexposed cursors will be ignored.
+    Unexposed cursors will be ignored. This visits every child of every
+    cursor containing the location, so get_smallest_cursor_containing should
+    be used to find just the innermost one.
+
+    The cursors are found in a single clang_visitChildren pass, which gives
+    statement cursors their enclosing declaration. They don't compare equal
+    to the same statements reached through get_children, as those of
+    get_smallest_cursor_containing are, so compare their kinds and extents
+    instead.
     """
     if cursors is None:
         cursors = []
     if not cursor_contains(cursor, loc):
         return cursors
-    if cursor.kind != ci.CursorKind.UNEXPOSED_EXPR:
+    if cursor._kind_id != UNEXPOSED_EXPR:
         cursors.append(cursor)
 
-    for child in cursor.get_children():
-        get_cursors_containing(child, loc, cursors)
+    def visitor(child, parent):
+        if not cursor_contains(child, loc):
+            # Skip its children.
+            return 1
+        if child._kind_id != UNEXPOSED_EXPR:
+            cursors.append(child)
+        # Recurse.
+        return 2
 
+    cursor.visit(visitor)
     return cursors
 
 
+def include_anchors(tu, filename):
+    """Return where each file included by a translation unit is pulled in.
+
+    The result maps the absolute path of each file to the offset in filename
+    of the #include through which it's included, directly or not.
+    """
+    filename = os.path.abspath(filename)
+    parents = dict()
+    for inclusion in tu.get_includes():
+        name = os.path.abspath(inclusion.include.name)
+        if name not in parents:
+            parents[name] = (os.path.abspath(inclusion.source.name),
+                             inclusion.location.offset)
+
+    anchors = dict()
+    for name in parents:
+        including = name
+        seen = set()
+        while including in parents and including not in seen:
+            seen.add(including)
+            including, offset = parents[including]
+            if including == filename:
+                anchors[name] = offset
+                break
+    return anchors
+
+
+class PointQuery:
+    """A location to find the innermost cursor around.
+
+    Siblings are in translation unit order, so a cursor's children can be
+    searched by bisection. Children from the location's own file are ordered
+    by offset. Children from other files are placed at the #include which
+    brought them in, and children without a file come first.
+    """
+
+    def __init__(self, tu, loc):
+        self.tu = tu
+        self.loc = loc
+        self.filename = os.path.abspath(loc.file.name)
+        self.anchors = None
+
+    def key(self, cursor):
+        """Return the position of a cursor relative to the location's file.
+
+        Return None if it's in a file not included from there.
+        """
+        start = cursor.extent.start
+        if start.file is None:
+            return -1
+        name = os.path.abspath(start.file.name)
+        if name == self.filename:
+            return start.offset
+        if self.anchors is None:
+            self.anchors = include_anchors(self.tu, self.filename)
+        return self.anchors.get(name)
+
+    def in_file(self, cursor):
+        """Return whether a cursor starts in the location's file."""
+        start = cursor.extent.start
+        return (start.file is not None and
+                os.path.abspath(start.file.name) == self.filename)
+
+    def child_containing(self, children):
+        """Return the smallest child containing the location, if any."""
+        offset = self.loc.offset
+        lo = 0
+        hi = len(children)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key = self.key(children[mid])
+            if key is None:
+                return self.scan(children)
+            if key <= offset:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        # Siblings can overlap, as with a struct declared in a typedef, so
+        # check the preceding ones until they end before the location.
+        best = None
+        for child in reversed(children[:lo]):
+            if not self.in_file(child):
+                break
+            extent = child.extent
+            if cursor_contains(child, self.loc):
+                if (best is None or extent.end.offset - extent.start.offset <
+                        best.extent.end.offset - best.extent.start.offset):
+                    best = child
+            elif extent.end.offset < offset:
+                break
+        return best
+
+    def scan(self, children):
+        """Return the smallest child containing the location, checking all."""
+        containing = [c for c in children if cursor_contains(c, self.loc)]
+        if not containing:
+            return None
+        return min(containing,
+                   key=lambda c: c.extent.end.offset - c.extent.start.offset)
+
+
 def get_smallest_cursor_containing(cursor, loc):
-    """Return the shortest child cursor containing the location."""
-    cursors = get_cursors_containing(cursor, loc)
+    """Return the innermost cursor containing the location.
 
-    if not cursors:
+    Only the child containing the location is descended into at each level,
+    and it's found by bisecting the children. Unexposed expressions are
+    skipped in favour of the cursor around them.
+    """
+    if loc.file is None or not cursor_contains(cursor, loc):
         return None
 
-    return min(cursors,
-               key=lambda c: c.extent.end.offset - c.extent.start.offset)
+    query = PointQuery(cursor._tu, loc)
+    innermost = None
+    while cursor is not None:
+        if cursor._kind_id != UNEXPOSED_EXPR:
+            innermost = cursor
+        cursor = query.child_containing(list(cursor.get_children()))
+    return innermost
 
 
-def find_cursor_at_pos(tu, filename, line, col):
-    """Find the cursor in the translation unit containing the position."""
+def refers_to_something(cursor):
+    """Return whether a cursor found at a position names an entity."""
+    if cursor is None:
+        return False
+    kind_id = cursor._kind_id
+    return (not ci.conf.lib.clang_isInvalid(kind_id) and
+            not ci.conf.lib.clang_isUnexposed(kind_id) and
+            cursor.referenced is not None)
+
+
+def get_token_cursor(tu, filename, line, loc):
+    """Return the cursor annotating the token at a location, if any.
+
+    The line is tokenized up to the location, so lexing starts at a token
+    boundary. A token ending at the location counts when no token contains
+    it, as with get_smallest_cursor_containing.
+    """
+    line_start = tu.get_location(filename, (line, 1))
+    extent = ci.SourceRange.from_locations(line_start, loc)
+    found = None
+    for token in tu.get_tokens(extent=extent):
+        token_extent = token.extent
+        if token_extent.start.offset > loc.offset:
+            break
+        if token_extent.end.offset > loc.offset:
+            found = token
+            break
+        if token_extent.end.offset == loc.offset:
+            found = token
+    if found is None:
+        return None
+    return found.cursor
+
+
+def find_cursor_at_pos(tu, filename, line, col, lookups=None):
+    """Find the cursor in the translation unit containing the position.
+
+    libclang is asked for the cursor at the position first, then for the
+    cursor of the token there. Only if neither refers to an entity is the AST
+    searched with get_smallest_cursor_containing. If lookups (a Counter) is
+    passed in, the way the cursor was found is counted in it as 'cursor',
+    'token' or 'descent'.
+    """
+    if lookups is None:
+        lookups = collections.Counter()
     loc = tu.get_location(filename, (line, col))
+    cursor = ci.Cursor.from_location(tu, loc)
+    if refers_to_something(cursor):
+        lookups['cursor'] += 1
+        return cursor
+
+    cursor = get_token_cursor(tu, filename, line, loc)
+    if refers_to_something(cursor):
+        lookups['token'] += 1
+        return cursor
+
+    lookups['descent'] += 1
     return get_smallest_cursor_containing(tu.cursor, loc)
 
 
@@ -89,85 +287,1133 @@ def find_definition(tu, filename, line, col, tus=None):
     Return None if it cannot be found."""
 
 
-def find_all_definitions(cursor):
+FUNCTION_KINDS = frozenset([ci.CursorKind.FUNCTION_DECL,
+                            ci.CursorKind.CXX_METHOD,
+                            ci.CursorKind.CONSTRUCTOR,
+                            ci.CursorKind.DESTRUCTOR,
+                            ci.CursorKind.CONVERSION_FUNCTION,
+                            ci.CursorKind.FUNCTION_TEMPLATE,
+                            ci.CursorKind.OBJC_INSTANCE_METHOD_DECL,
+                            ci.CursorKind.OBJC_CLASS_METHOD_DECL])
+
+# What follows the declarator of a function definition.
+FUNCTION_BODY_START = re.compile(r'\s*(\{|:|try\b)')
+
+
+def parsed_sources(tu):
+    """Return a cache of file contents for has_skipped_body.
+
+    It starts with the unsaved contents the translation unit was last parsed
+    with, keyed by absolute path, as offsets into those files refer to them
+    rather than to what's on disk.
+    """
+    return dict((os.path.abspath(name), contents)
+                for name, contents in tu.unsaved_files)
+
+
+def has_skipped_body(cursor, sources):
+    """Return whether a function declaration had its body skipped.
+
+    When parsing with PARSE_SKIP_FUNCTION_BODIES, libclang no longer reports
+    functions as definitions, but they can be recognized by the body that
+    follows them in the source. sources caches file contents by absolute
+    path, as returned by parsed_sources.
+    """
+    if cursor.kind not in FUNCTION_KINDS:
+        return False
+
+    end = cursor.extent.end
+    if end.file is None:
+        return False
+    name = os.path.abspath(end.file.name)
+    try:
+        text = sources[name]
+    except KeyError:
+        try:
+            with open(name, 'rb') as f:
+                text = f.read()
+        except IOError:
+            text = ''
+        sources[name] = text
+    return FUNCTION_BODY_START.match(text, end.offset) is not None
+
+
+def is_definition(cursor, skipped_bodies, sources):
+    """Return whether a cursor is a definition.
+
+    If skipped_bodies is set, its translation unit was parsed without function
+    bodies.
+    """
+    if cursor.is_definition():
+        return True
+    return skipped_bodies and has_skipped_body(cursor, sources)
+
+
+# The ids of the cursor kinds each kind test is true for, keyed by test.
+KIND_IDS = dict()
+
+
+def kind_ids(test):
+    """Return the ids of the cursor kinds for which test(kind) is true.
+
+    The result is cached, as tests like CursorKind.is_declaration call into
+    libclang.
+    """
+    try:
+        return KIND_IDS[test]
+    except KeyError:
+        ids = frozenset(kind.value for kind in ci.CursorKind.get_all_kinds()
+                        if test(kind))
+        KIND_IDS[test] = ids
+        return ids
+
+
+def find_all_definitions(cursor, skipped_bodies=False, include_local=True):
     """Find all definitions that are children of the cursor.
 
     The returned definitions will be a dict of cursors, keyed by their USR.
+    If skipped_bodies is set, the translation unit was parsed without function
+    bodies. If include_local is False, function bodies aren't searched, so
+    local variables and types are left out.
     """
-    def visitor(child, parent, acc_defns):
-        if child.is_definition():
-            acc_defns[child.get_usr()] = child
-        # Recurse.
-        return 2
-
+    sources = parsed_sources(cursor.translation_unit)
     defns = dict()
-    ci.conf.lib.clang_visitChildren(cursor,
-                                    ci.callbacks['cursor_visit'](visitor),
-                                    defns)
-
+    for child in cursor.find_descendants(
+            kind_ids(ci.CursorKind.is_declaration),
+            skip_bodies=not include_local):
+        if is_definition(child, skipped_bodies, sources):
+            defns[child.get_usr()] = child
     return defns
 
 
+def export_cursor_table(cursor):
+    """Return a CursorTable of every cursor below the cursor.
+
+    Unlike find_all_definitions, this doesn't create a Cursor for each
+    result, so it's suited to filtering and aggregating a whole translation
+    unit at once.
+    """
+    return CursorTable(cursor)
+
+
+# Expression kinds that refer to a declaration elsewhere.
+REFERENCE_EXPR_KINDS = frozenset([ci.CursorKind.DECL_REF_EXPR,
+                                  ci.CursorKind.MEMBER_REF_EXPR])
+
+
+def is_symbol_kind(kind):
+    """Return whether cursors of a kind declare or refer to a symbol."""
+    return (kind.is_declaration() or kind.is_reference() or
+            kind in REFERENCE_EXPR_KINDS)
+
+
+# Filenames interned for SymbolRecords, and the id of each. Records compare
+# by file id, so every index in the process shares these. Ids are never
+# reused, since a record may outlive the index that made it; there's one
+# entry per file ever seen, which is small next to the records themselves.
+_filenames = []
+_file_ids = dict()
+_file_ids_lock = threading.Lock()
+
+
+def intern_filename(filename):
+    """Return the id of a filename, or None if it's None."""
+    if filename is None:
+        return None
+    try:
+        return _file_ids[filename]
+    except KeyError:
+        with _file_ids_lock:
+            if filename not in _file_ids:
+                _file_ids[filename] = len(_filenames)
+                _filenames.append(filename)
+            return _file_ids[filename]
+
+
+class SymbolRecord(object):
+    """The location of a symbol, detached from any translation unit.
+
+    Unlike a Cursor, a record doesn't keep its translation unit alive, and
+    takes a fraction of the memory. Records are immutable. The filename is
+    stored as an id from intern_filename. The offset and kind_id are None
+    for symbols read from a snapshot or the symbol store.
+    """
+    __slots__ = ('usr', 'file_id', 'line', 'column', 'offset', 'kind_id',
+                 'displayname')
+
+    def __init__(self, usr, file_id, line, column, offset, kind_id,
+                 displayname):
+        for name, value in zip(self.__slots__, (usr, file_id, line, column,
+                                                offset, kind_id,
+                                                displayname)):
+            object.__setattr__(self, name, value)
+
+    @classmethod
+    def from_cursor(cls, cursor, usr=None):
+        """Return the record of the symbol a cursor declares.
+
+        usr is the cursor's USR, if it's already known.
+        """
+        if usr is None:
+            usr = cursor.get_usr()
+        loc = cursor.location
+        filename = loc.file.name if loc.file is not None else None
+        return cls(usr, intern_filename(filename), loc.line, loc.column,
+                   loc.offset, cursor._kind_id, cursor.displayname)
+
+    @classmethod
+    def from_row(cls, row):
+        """Return a record from a (usr, filename, line, column, displayname)
+        row of a snapshot or the symbol store."""
+        usr, filename, line, column, displayname = row
+        return cls(usr, intern_filename(filename), line, column, None, None,
+                   displayname)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('SymbolRecord is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('SymbolRecord is immutable')
+
+    def key(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return isinstance(other, SymbolRecord) and self.key() == other.key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return 'SymbolRecord({})'.format(', '.join(
+            '{}={!r}'.format(name, getattr(self, name))
+            for name in self.__slots__))
+
+    @property
+    def filename(self):
+        """The file the symbol is in, or None."""
+        if self.file_id is None:
+            return None
+        return _filenames[self.file_id]
+
+    @property
+    def kind(self):
+        """The CursorKind of the symbol's declaration, or None."""
+        if self.kind_id is None:
+            return None
+        return ci.CursorKind.from_id(self.kind_id)
+
+
+def collect_symbols(cursor, skipped_bodies=False):
+    """Collect the definitions, declarations and references under the cursor.
+
+    The result is a list of (usr, role, filename, line, column, displayname)
+    tuples, where role is one of the symbol_store roles. If skipped_bodies is
+    set, the translation unit was parsed without function bodies.
+    """
+    sources = parsed_sources(cursor.translation_unit)
+    declarations = kind_ids(ci.CursorKind.is_declaration)
+
+    def callback(child):
+        if child._kind_id in declarations:
+            usr = child.get_usr()
+            if is_definition(child, skipped_bodies, sources):
+                role = symbol_store.DEFINITION
+            else:
+                role = symbol_store.DECLARATION
+        else:
+            referenced = child.referenced
+            if referenced is None:
+                return
+            usr = referenced.get_usr()
+            role = symbol_store.REFERENCE
+
+        loc = child.location
+        if usr and loc.file is not None:
+            symbols.append((usr, role, loc.file.name, loc.line, loc.column,
+                            child.displayname))
+
+    symbols = []
+    cursor.visit_kinds(kind_ids(is_symbol_kind), callback)
+    return symbols
+
+
+def symbols_by_file(symbols):
+    """Group symbol tuples from collect_symbols by the file each is in.
+
+    Return a dict of lists of tuples, keyed by absolute path, so a header's
+    symbols can be stored under the header rather than under each file that
+    includes it.
+    """
+    files = dict()
+    for symbol in symbols:
+        files.setdefault(os.path.abspath(symbol[2]), []).append(symbol)
+    return files
+
+
+def location_of(defn):
+    """Return the (filename, line, column) of a definition.
+
+    The definition may be a Cursor or a SymbolRecord.
+    """
+    if isinstance(defn, SymbolRecord):
+        return defn.filename, defn.line, defn.column
+    loc = defn.location
+    return loc.file.name, loc.line, loc.column
+
+
+# Parse options for the translation unit being edited, which needs a full AST
+# and is reparsed often, and for translation units only loaded to answer
+# queries about other files, which only need declarations. The active one
+# keeps a precompiled preamble, built straight away, so reparses only process
+# the main file. Background ones are only reparsed when a file they include
+# changes, which would rebuild the preamble anyway, so they don't keep one.
+ACTIVE_PARSE_OPTIONS = (
+    ci.TranslationUnit.PARSE_PRECOMPILED_PREAMBLE |
+    ci.TranslationUnit.PARSE_CREATE_PREAMBLE_ON_FIRST_PARSE)
+BACKGROUND_PARSE_OPTIONS = ci.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES
+
+HEADER_EXTENSIONS = frozenset(['.h', '.hh', '.hpp', '.hxx', '.h++', '.inl'])
+
+
+def parse_options(filename, active):
+    """Return the options to parse a file with, depending on its role."""
+    if active:
+        options = ACTIVE_PARSE_OPTIONS
+    else:
+        options = BACKGROUND_PARSE_OPTIONS
+    _, ext = os.path.splitext(filename)
+    if ext in HEADER_EXTENSIONS:
+        options |= ci.TranslationUnit.PARSE_INCOMPLETE
+    return options
+
+
+def preamble_bytes(tu):
+    """Return the bytes used by a translation unit's precompiled preamble.
+
+    The preamble is loaded as an external AST source, so this is the memory
+    used by one, and zero if there's no preamble.
+    """
+    return sum(amount
+               for kind, amount in tu.get_resource_usage().iteritems()
+               if kind.startswith('ExternalASTSource'))
+
+
+def preamble_state(tu, includes, unsaved_files):
+    """Return what a translation unit's precompiled preamble was built from.
+
+    This is the size of the preamble, and the state of each file the
+    translation unit includes, as listed in includes: a checksum of its
+    contents if it's unsaved, or else its modification time and size.
+    libclang rebuilds the preamble when any of these change, so if the state
+    after a reparse is the same as after the previous parse, the preamble was
+    reused. Return None if there's no preamble.
+    """
+    size = preamble_bytes(tu)
+    if not size:
+        return None
+    unsaved = unsaved_by_path(unsaved_files)
+    files = dict()
+    for name in includes:
+        name = os.path.abspath(name)
+        files[name] = file_state(name, unsaved)
+    return size, files
+
+
+def unsaved_by_path(unsaved_files):
+    """Return the contents of unsaved files keyed by absolute path."""
+    return dict((os.path.abspath(name), contents)
+                for name, contents in unsaved_files or ())
+
+
+def file_state(name, unsaved):
+    """Return something which changes when the contents of a file do.
+
+    This is a checksum of its contents if it's in unsaved, a dict from
+    unsaved_by_path, or else its modification time and size. Return None if
+    it doesn't exist.
+    """
+    if name in unsaved:
+        return zlib.crc32(unsaved[name])
+    try:
+        info = os.stat(name)
+    except OSError:
+        return None
+    return info.st_mtime, info.st_size
+
+
+def stored_hash(name, unsaved):
+    """Return the symbol_store hash of a file, or None if it can't be read."""
+    if name in unsaved:
+        return symbol_store.content_hash(unsaved[name])
+    try:
+        return symbol_store.file_hash(name)
+    except IOError:
+        return None
+
+
+def file_mtime(filename):
+    """Return the modification time of a file, or None if it doesn't exist."""
+    try:
+        return os.path.getmtime(filename)
+    except OSError:
+        return None
+
+
+class ChangeTracker:
+    """Track which files changed between observations of their state.
+
+    The state of a file is anything that changes when its contents do, such
+    as an editor's change counter and the file's modification time.
+    """
+
+    def __init__(self):
+        self.states = dict()
+
+    def update(self, filename, state, modified=False):
+        """Record the state of a file, and return whether it changed.
+
+        The first time a file is seen, it's considered changed if it's
+        modified relative to what's on disk.
+        """
+        previous = self.states.get(filename)
+        self.states[filename] = state
+        if previous is None:
+            return modified
+        return previous != state
+
+    def forget(self, filename):
+        """Stop tracking a file."""
+        self.states.pop(filename, None)
+
+
+def load_tu(index, filename, args, options, ast_cache=None,
+            unsaved_files=None):
+    """Load a translation unit from an AstCache, or parse it.
+
+    Return the translation unit, and whether it was loaded from the cache. If
+    it can't be loaded, throw TranslationUnitLoadError.
+    """
+    if ast_cache is not None and not unsaved_files:
+        tu = ast_cache.load(filename, args, options, index)
+        if tu is not None:
+            return tu, True
+    tu = index.parse(filename, args, unsaved_files, options)
+    if ast_cache is not None and not unsaved_files:
+        ast_cache.save(filename, args, options, tu)
+    return tu, False
+
+
+def reparse_job(index, tu, options, unsaved_files):
+    """Reparse a translation unit on a ParsePool worker.
+
+    The worker's index is unused, as the translation unit keeps its own.
+    """
+    tu.reparse(unsaved_files)
+
+
+def tu_memory_total(tu):
+    """Return the total number of bytes used by a translation unit."""
+    return sum(tu.get_resource_usage().itervalues())
+
+
 class CrossTUIndex:
     """Index and cache across translation units."""
 
-    def __init__(self):
+    def __init__(self, store=None, snapshot=None, flags=None,
+                 ast_cache=None, max_tus=0, max_bytes=0, pinned=None,
+                 pool=None):
         self.index = ci.Index.create()
-        self.tus = dict()
+        # An optional ParsePool to parse several translation units at once,
+        # and the unfinished job for each translation unit given to it. A
+        # translation unit with a job must not be touched until it finishes.
+        self.pool = pool
+        self.jobs = dict()
+        # Translation units whose jobs started before their files changed
+        # again, and the unsaved files to reparse them with once they finish.
+        self.requeued = dict()
+        # Loaded translation units, least recently used first.
+        self.tus = collections.OrderedDict()
+        # Translation units are evicted when there are more than max_tus of
+        # them, or when they use more than max_bytes in total, as measured by
+        # tu_size. Zero means no limit. pinned is an optional function
+        # returning filenames that must never be evicted.
+        self.max_tus = max_tus
+        self.max_bytes = max_bytes
+        self.tu_size = tu_memory_total
+        self.tu_bytes = dict()
+        self.pinned = pinned
+        self.evicted = set()
+        # An optional AstCache of saved translation units, and the files
+        # whose translation units were loaded from it.
+        self.ast_cache = ast_cache
+        self.loaded_from_ast = set()
+        # An optional CompileFlags giving the arguments to parse files with.
+        self.flags = flags
+        # An optional SymbolStore that persists symbols between sessions.
+        self.store = store
+        # An optional read-only FlatIndex of definitions.
+        self.snapshot = snapshot
+        # How many reparses reused a precompiled preamble, and how many had
+        # to build one, and the preamble_state of each loaded translation
+        # unit when it was last parsed.
+        self.preamble_hits = 0
+        self.preamble_misses = 0
+        self.preamble_states = dict()
+        # How many cursors find_cursor_at_pos found each way.
+        self.lookups = collections.Counter()
+        # The CursorIndex of each translation unit's own file, built once the
+        # translation unit has been queried twice since it was last parsed,
+        # and the number of queries so far.
+        self.cursor_indexes = dict()
+        self.position_queries = collections.Counter()
+        # The file being edited, and the options each loaded translation unit
+        # was parsed with.
+        self.active = None
+        self.tu_options = dict()
+        # The files included by each translation unit that was ever loaded,
+        # including evicted ones.
+        self.includes = IncludeGraph()
+        # SymbolRecords of the definitions found in each translation unit,
+        # keyed by filename and then by USR. These are kept when the
+        # translation unit is evicted, until its file changes on disk, which
+        # is tracked by modification time.
+        self.tu_definitions = dict()
+        self.evicted_changes = ChangeTracker()
+        # The merged USR -> definition map across all translation units, and
+        # the set of translation units defining each USR.
+        self.definitions = dict()
+        self.definition_owners = dict()
+        # The state of each included file when its stored symbols were last
+        # checked, so a header is only hashed again once it changes.
+        self.stored_includes = ChangeTracker()
 
     def get_or_parse_tu(self, filename):
         """Get the translation unit, parsing it if it's not already loaded.
 
         If it can't be loaded, throw TranslationUnitLoadError."""
+        self.finish_job(filename)
         try:
-            return self.tus[filename]
+            tu = self.tus.pop(filename)
         except KeyError:
-            # This can throw TranslationUnitLoadError.
-            tu = self.index.parse(filename)
-            self.tus[filename] = tu
-            return tu
+            return self.parse_tu(filename)
+        # Mark it as the most recently used.
+        self.tus[filename] = tu
+        return tu
 
-    def parse_tu(self, filename):
+    def parse_tu(self, filename, unsaved_files=None):
         """Parse the new translation unit.
 
-        It must not already be loaded. If it can't be loaded, throw
-        TranslationUnitLoadError.
+        The active file gets a full AST, and other files are parsed without
+        function bodies. It must not already be loaded. If it can't be loaded,
+        throw TranslationUnitLoadError.
         """
         assert filename not in self.tus
-        tu = self.index.parse(filename)
+        options = parse_options(filename, filename == self.active)
+        # This can throw TranslationUnitLoadError.
+        tu, from_ast = load_tu(self.index, filename, self.arguments(filename),
+                               options, self.ast_cache, unsaved_files)
+        return self.add_tu(filename, tu, options, from_ast, unsaved_files)
+
+    def add_tu(self, filename, tu, options, from_ast, unsaved_files=None):
+        """Add a newly loaded translation unit."""
+        if from_ast:
+            self.loaded_from_ast.add(filename)
+        self.tus[filename] = tu
+        self.tu_options[filename] = options
+        self.evicted.discard(filename)
+        self.evicted_changes.forget(filename)
+        self.refresh_tu(filename, unsaved_files)
+        self.enforce_budget(filename)
+        return tu
+
+    def reparse_tu(self, filename, unsaved_files=None):
+        """Reparse a translation unit and refresh its definitions.
+
+        Only the unsaved files the translation unit includes are passed on to
+        libclang. An evicted translation unit is parsed again once, with the
+        unsaved files.
+        """
+        self.finish_job(filename)
+        unsaved_files = self.tu_unsaved_files(filename, unsaved_files)
+        if filename not in self.tus:
+            return self.parse_tu(filename, unsaved_files)
+        reparsed = False
+        if filename in self.loaded_from_ast:
+            # Translation units loaded from an AST file can't be reparsed, so
+            # parse this one from source instead.
+            tu = self.replace_tu(filename, self.tu_options[filename],
+                                 unsaved_files)
+        else:
+            tu = self.get_or_parse_tu(filename)
+            tu.reparse(unsaved_files)
+            reparsed = True
+        self.refresh_tu(filename, unsaved_files, reparsed)
+        self.enforce_budget(filename)
+        return tu
+
+    def refresh_tu(self, filename, unsaved_files=None, reparsed=False):
+        """Update everything derived from a newly (re)parsed translation unit.
+
+        This must be called whenever the translation unit is parsed or
+        reparsed, as the cursors from the previous generation are invalid.
+        reparsed is whether it was reparsed rather than parsed from scratch.
+        """
+        self.drop_cursor_index(filename)
+        includes = self.record_includes(filename)
+        self.record_preamble(filename, includes, unsaved_files, reparsed)
+        self.index_definitions(filename)
+        self.store_symbols(filename, unsaved_files)
+        self.measure_tu(filename)
+
+    def record_includes(self, filename):
+        """Record the files a translation unit includes, and return them."""
+        includes = set(inclusion.include.name
+                       for inclusion in self.tus[filename].get_includes())
+        self.includes.update(filename, includes)
+        return includes
+
+    def including_tus(self, filename):
+        """Return the translation units known to include a file."""
+        return self.includes.including(filename)
+
+    def tu_unsaved_files(self, filename, unsaved_files):
+        """Return the unsaved files which are part of a translation unit.
+
+        These are its own file and the files it included when it was last
+        parsed.
+        """
+        if not unsaved_files:
+            return unsaved_files
+        own = os.path.abspath(filename)
+        includes = self.includes.includes_of(filename)
+        return [(name, contents) for name, contents in unsaved_files
+                if os.path.abspath(name) == own or
+                os.path.abspath(name) in includes]
+
+    def dirty_tus(self, changed_files):
+        """Return the loaded translation units affected by changed files.
+
+        A translation unit is affected if its own file or any file it
+        includes changed. The definitions kept for an evicted translation unit
+        are dropped if it's affected, or its file was modified on disk since
+        it was evicted, as they may no longer be there.
+        """
+        affected = self.includes.affected(changed_files)
+        for filename in self.evicted:
+            if (filename in affected or
+                    self.evicted_changes.update(filename,
+                                                file_mtime(filename))):
+                self.forget_definitions(filename)
+        return [filename for filename in self.tus if filename in affected]
+
+    def invalidate(self, changed_files):
+        """Mark everything derived from changed files as out of date.
+
+        The stored symbols of every translation unit affected by the changes
+        are marked stale, whether or not it's loaded, so they are written
+        again when it's next parsed. Return the loaded translation units that
+        need to be reparsed.
+        """
+        if self.store is not None:
+            for filename in self.includes.affected(changed_files):
+                self.store.invalidate(filename)
+        return self.dirty_tus(changed_files)
+
+    def record_preamble(self, filename, includes, unsaved_files, reparsed):
+        """Record what a translation unit's precompiled preamble is built from.
+
+        After a reparse, count whether the preamble was reused, so only the
+        main file was parsed again. It was if nothing it's built from changed
+        since the previous parse.
+        """
+        if not (self.tu_options[filename] &
+                ci.TranslationUnit.PARSE_PRECOMPILED_PREAMBLE):
+            self.preamble_states.pop(filename, None)
+            return
+        previous = self.preamble_states.get(filename)
+        state = preamble_state(self.tus[filename], includes, unsaved_files)
+        self.preamble_states[filename] = state
+        if not reparsed:
+            return
+        if state is not None and state == previous:
+            self.preamble_hits += 1
+        else:
+            print_debug('preamble miss {}'.format(filename))
+            self.preamble_misses += 1
+
+    def parse_tus(self, filenames, timeout=None):
+        """Parse new translation units, several at once if there's a pool.
+
+        Translation units which can't be loaded are skipped. See finish_jobs
+        for timeout. Return the translation units that were loaded.
+        """
+        filenames = [f for f in filenames
+                     if f not in self.tus and f not in self.jobs]
+        if self.pool is None:
+            loaded = []
+            for filename in filenames:
+                try:
+                    self.parse_tu(filename)
+                    loaded.append(filename)
+                except ci.TranslationUnitLoadError:
+                    print_warning('Failed to parse {}'.format(filename))
+            return loaded
+
+        for filename in filenames:
+            options = parse_options(filename, filename == self.active)
+            self.jobs[filename] = (self.pool.submit(
+                load_tu, filename, self.arguments(filename), options,
+                self.ast_cache, priority=self.job_priority(filename)),
+                options, None)
+        return self.finish_jobs(timeout)
+
+    def reparse_tus(self, filenames, unsaved_files=None, timeout=None):
+        """Reparse loaded translation units, several at once if there's a pool.
+
+        Translation units which fail to reparse are evicted. See finish_jobs
+        for timeout. Return the translation units that were reparsed.
+        """
+        if self.pool is None:
+            reparsed = []
+            for filename in filenames:
+                try:
+                    self.reparse_tu(filename, unsaved_files)
+                    reparsed.append(filename)
+                except ci.TranslationUnitLoadError:
+                    print_warning('Failed to reparse {}'.format(filename))
+                    self.evict_tu(filename)
+            return reparsed
+
+        for filename in filenames:
+            if filename in self.jobs:
+                job = self.jobs[filename][0]
+                if filename in self.tus and job.cancel():
+                    # It hadn't started, so this reparse replaces it.
+                    del self.jobs[filename]
+                else:
+                    # It's working on out of date files. Reparse it again
+                    # once it's finished.
+                    self.requeued[filename] = unsaved_files
+                    continue
+            if filename not in self.tus:
+                # Evicted translation units are loaded when they're needed.
+                continue
+            self.submit_reparse(filename, unsaved_files)
+        return self.finish_jobs(timeout)
+
+    def job_priority(self, filename):
+        """Return the priority of a job on a translation unit.
+
+        The active file comes first, as it's the one being edited.
+        """
+        if filename == self.active:
+            return 0
+        return 1
+
+    def submit_reparse(self, filename, unsaved_files):
+        """Queue a job to reparse a loaded translation unit on the pool."""
+        unsaved_files = self.tu_unsaved_files(filename, unsaved_files)
+        options = self.tu_options[filename]
+        priority = self.job_priority(filename)
+        if filename in self.loaded_from_ast:
+            # Saved ASTs can't be reparsed, so parse from source.
+            job = self.pool.submit(load_tu, filename,
+                                   self.arguments(filename), options, None,
+                                   unsaved_files, priority=priority)
+        else:
+            job = self.pool.submit(reparse_job, self.tus[filename], options,
+                                   unsaved_files, priority=priority)
+        self.jobs[filename] = (job, options, unsaved_files)
+
+    def finish_jobs(self, timeout=None):
+        """Apply the results of jobs as they finish.
+
+        If timeout is given, stop waiting after that many seconds, and leave
+        any unfinished jobs to be applied later. Return the translation units
+        whose jobs were applied.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        finished = []
+        while self.jobs:
+            jobs = dict((job, filename)
+                        for filename, (job, _, _) in self.jobs.iteritems())
+            done = wait_for_any(jobs.keys(), deadline)
+            if not done:
+                break
+            for job in done:
+                if self.apply_job(jobs[job]):
+                    finished.append(jobs[job])
+        return finished
+
+    def finish_job(self, filename):
+        """Wait for the job on a translation unit, if any, and apply it."""
+        while filename in self.jobs:
+            self.jobs[filename][0].wait()
+            self.apply_job(filename)
+
+    def apply_job(self, filename):
+        """Apply the result of a finished job to its translation unit.
+
+        Return whether it succeeded.
+        """
+        job, options, unsaved_files = self.jobs.pop(filename)
+        try:
+            result = job.get()
+        except JobCancelled:
+            return False
+        except ci.TranslationUnitLoadError:
+            print_warning('Failed to load {}'.format(filename))
+            if filename in self.tus:
+                # Its translation unit can no longer be used.
+                self.evict_tu(filename)
+            return False
+
+        reparsed = job.function is reparse_job
+        if not reparsed:
+            tu, from_ast = result
+            if filename in self.tus:
+                del self.tus[filename]
+                self.loaded_from_ast.discard(filename)
+            self.tus[filename] = tu
+            self.tu_options[filename] = options
+            if from_ast:
+                self.loaded_from_ast.add(filename)
+            self.evicted.discard(filename)
+
+        if filename in self.requeued:
+            # The result is already out of date, so don't index it. The
+            # definitions from before are kept until it is, but its cursors
+            # can't be used after a reparse.
+            self.drop_cursor_index(filename)
+            self.submit_reparse(filename, self.requeued.pop(filename))
+            return False
+
+        self.refresh_tu(filename, unsaved_files, reparsed)
+        self.enforce_budget(filename)
+        return True
+
+    def stats(self):
+        """Return a dict of statistics about the index."""
+        return {
+            'tus': len(self.tus),
+            'evicted': len(self.evicted),
+            'definitions': len(self.definitions),
+            'preamble_hits': self.preamble_hits,
+            'preamble_misses': self.preamble_misses,
+            'cursor_lookups': self.lookups['cursor'],
+            'token_lookups': self.lookups['token'],
+            'descent_lookups': self.lookups['descent'],
+            'interval_lookups': self.lookups['interval'],
+            'interval_misses': self.lookups['interval_miss'],
+        }
+
+    def replace_tu(self, filename, options, unsaved_files=None):
+        """Parse a loaded translation unit again from source.
+
+        This is needed to change the options it's parsed with. The caller
+        must call refresh_tu.
+        """
+        tu = self.index.parse(filename, self.arguments(filename),
+                              unsaved_files, options)
+        del self.tus[filename]
         self.tus[filename] = tu
+        self.tu_options[filename] = options
+        self.loaded_from_ast.discard(filename)
         return tu
 
+    def cursor_index(self, filename):
+        """Return the CursorIndex of a loaded translation unit's own file.
+
+        Building one reads every cursor in the file, so it's only worth it
+        for a translation unit queried repeatedly. Return None the first time
+        a translation unit is queried after it's parsed.
+        """
+        cursors = self.cursor_indexes.get(filename)
+        if cursors is None:
+            self.position_queries[filename] += 1
+            if self.position_queries[filename] < 2:
+                return None
+            cursors = CursorIndex(self.tus[filename], filename)
+            self.cursor_indexes[filename] = cursors
+        return cursors
+
+    def drop_cursor_index(self, filename):
+        """Forget the CursorIndex of a translation unit, which is now stale."""
+        self.cursor_indexes.pop(filename, None)
+        self.position_queries.pop(filename, None)
+
+    def skipped_bodies(self, filename):
+        """Return whether a translation unit was parsed without bodies."""
+        return bool(self.tu_options[filename] &
+                    ci.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES)
+
+    def set_active(self, filename, unsaved_files=None):
+        """Make a file the one being edited.
+
+        If its translation unit was loaded in the background without function
+        bodies, it's parsed again with a full AST.
+        """
+        self.active = filename
+        self.finish_job(filename)
+        if filename not in self.tus:
+            return
+
+        options = parse_options(filename, True)
+        if self.tu_options[filename] == options:
+            return
+
+        print_debug('upgrade_tu {}'.format(filename))
+        self.replace_tu(filename, options, unsaved_files)
+        self.refresh_tu(filename, unsaved_files)
+
+    def measure_tu(self, filename):
+        """Record how many bytes a translation unit uses."""
+        if self.tu_size is not None:
+            self.tu_bytes[filename] = self.tu_size(self.tus[filename])
+
+    def memory_usage(self):
+        """Return the memory used by each loaded translation unit.
+
+        The result is a dict keyed by filename, of dicts of the number of bytes
+        used by each kind of resource. Translation units with unfinished jobs
+        are left out, as the pool may be using them.
+        """
+        return dict((filename, tu.get_resource_usage())
+                    for filename, tu in self.tus.iteritems()
+                    if filename not in self.jobs)
+
+    def total_memory_usage(self):
+        """Return the bytes used by all translation units, by resource kind.
+
+        Like memory_usage, this leaves out those with unfinished jobs.
+        """
+        totals = dict()
+        for usage in self.memory_usage().itervalues():
+            for kind, amount in usage.iteritems():
+                totals[kind] = totals.get(kind, 0) + amount
+        return totals
+
+    def over_budget(self):
+        """Return whether the loaded translation units exceed the budget."""
+        if self.max_tus and len(self.tus) > self.max_tus:
+            return True
+        if self.max_bytes and sum(self.tu_bytes.itervalues()) > self.max_bytes:
+            return True
+        return False
+
+    def enforce_budget(self, keep):
+        """Evict least recently used translation units until within budget.
+
+        The translation unit for keep and any pinned files are never evicted.
+        """
+        if not self.over_budget():
+            return
+
+        # Translation units with unfinished jobs are in use by the pool.
+        pinned = set([keep])
+        pinned.update(self.jobs)
+        if self.pinned is not None:
+            pinned.update(self.pinned())
+
+        for filename in list(self.tus):
+            if not self.over_budget():
+                break
+            if filename not in pinned:
+                self.evict_tu(filename)
+
+    def evict_tu(self, filename):
+        """Unload a translation unit.
+
+        It will be parsed again by get_or_parse_tu when it's next needed.
+        Its definitions don't refer to it, so they're kept until then, unless
+        dirty_tus finds its file changed.
+        """
+        print_debug('evict_tu {}'.format(filename))
+        self.drop_cursor_index(filename)
+        self.requeued.pop(filename, None)
+        del self.tus[filename]
+        del self.tu_options[filename]
+        self.tu_bytes.pop(filename, None)
+        self.preamble_states.pop(filename, None)
+        self.loaded_from_ast.discard(filename)
+        self.evicted.add(filename)
+        self.evicted_changes.update(filename, file_mtime(filename))
+
+    def arguments(self, filename):
+        """Return the arguments to parse a file with, or None."""
+        if self.flags is None:
+            return None
+        return self.flags.arguments(filename)
+
+    def store_symbols(self, filename, unsaved_files=None):
+        """Write the symbols of a translation unit to the store, if any.
+
+        Only the symbols in the file itself are stored under it. Those in
+        each file it includes are stored under that file, without arguments,
+        so a header's rows are written once however many files include it.
+        The stored rows of a file are only replaced if its contents, or for
+        the translation unit's own file its compile arguments, changed since
+        they were written.
+        """
+        if self.store is None:
+            return
+
+        unsaved = unsaved_by_path(unsaved_files)
+        skipped_bodies = self.skipped_bodies(filename)
+        stale = []
+        own = os.path.abspath(filename)
+        content_hash = stored_hash(own, unsaved)
+        args = self.arguments(filename)
+        if (content_hash is not None and
+                not self.store.is_current(filename, content_hash, args,
+                                          skipped_bodies)):
+            stale.append((filename, own, content_hash, args))
+        for name in self.includes.includes_of(filename):
+            if not self.stored_includes.update(
+                    name, file_state(name, unsaved), modified=True):
+                continue
+            content_hash = stored_hash(name, unsaved)
+            if (content_hash is not None and
+                    not self.store.is_current(name, content_hash, None,
+                                              skipped_bodies)):
+                stale.append((name, name, content_hash, None))
+        if not stale:
+            return
+
+        symbols = symbols_by_file(
+            collect_symbols(self.tus[filename].cursor, skipped_bodies))
+        for source, path, content_hash, args in stale:
+            self.store.replace_file(source, content_hash, args,
+                                    symbols.get(path, ()), skipped_bodies)
+
+    def index_definitions(self, filename):
+        """Rebuild the definitions contributed by one translation unit."""
+        self.forget_definitions(filename)
+        # Definitions local to a function body can only be referred to from
+        # the same translation unit, where find_definition finds them itself.
+        defns = dict(
+            (usr, SymbolRecord.from_cursor(cursor, usr))
+            for usr, cursor in find_all_definitions(
+                self.tus[filename].cursor, self.skipped_bodies(filename),
+                include_local=False).iteritems())
+        self.tu_definitions[filename] = defns
+        for usr, defn in defns.iteritems():
+            self.definition_owners.setdefault(usr, set()).add(filename)
+            self.definitions.setdefault(usr, defn)
+
+    def forget_definitions(self, filename):
+        """Remove the definitions contributed by one translation unit."""
+        defns = self.tu_definitions.pop(filename, None)
+        if not defns:
+            return
+
+        for usr, defn in defns.iteritems():
+            owners = self.definition_owners[usr]
+            owners.discard(filename)
+            if not owners:
+                del self.definition_owners[usr]
+                del self.definitions[usr]
+            elif self.definitions[usr] is defn:
+                # Another translation unit also defines this, so use its
+                # definition instead.
+                other = next(iter(owners))
+                self.definitions[usr] = self.tu_definitions[other][usr]
+
     def find_definition(self, filename, line, col):
         """Find the definition of the symbol at the given position.
 
-        Return None if it cannot be found.
+        The cursor there is looked up in the file's CursorIndex. If that
+        cursor doesn't refer to anything, it's looked up again with
+        find_cursor_at_pos, so such a miss costs both lookups; misses are
+        counted in the interval_misses statistic.
+
+        Return a SymbolRecord, or None if it cannot be found.
         """
+        if (filename not in self.tus and filename not in self.evicted and
+                filename not in self.jobs):
+            return None
+
+        # Queries are made from the file being edited, which needs a full AST.
         try:
-            cursor = find_cursor_at_pos(self.tus[filename],
-                                        filename, line, col)
-        except KeyError:
+            self.set_active(filename)
+            tu = self.get_or_parse_tu(filename)
+        except ci.TranslationUnitLoadError:
             return None
 
+        cursor = None
+        cursors = self.cursor_index(filename)
+        if cursors is not None:
+            cursor = cursors.cursor_at(tu, line, col)
+        if refers_to_something(cursor):
+            self.lookups['interval'] += 1
+        else:
+            if cursors is not None:
+                self.lookups['interval_miss'] += 1
+            cursor = find_cursor_at_pos(tu, filename, line, col,
+                                        self.lookups)
+
         if cursor is None:
             return None
 
-        if cursor.referenced is None:
+        referenced = cursor.referenced
+        if referenced is None:
             return None
 
         # If the definition is in this TU, return it immediately.
-        if cursor.referenced.is_definition():
-            return cursor.referenced
+        if referenced.is_definition():
+            return SymbolRecord.from_cursor(referenced)
 
-        # Otherwise we need to go searching in other TUs.
-        if not self.tus:
-            return cursor.referenced
+        # Otherwise look it up in the definitions from other TUs.
+        usr = referenced.get_usr()
+        try:
+            return self.definitions[usr]
+        except KeyError:
+            pass
 
-        usr = cursor.referenced.get_usr()
-        for tu in self.tus.itervalues():
-            defns = find_all_definitions(tu.cursor)
-            if usr in defns:
-                return defns[usr]
+        # Then in the snapshot and the symbols stored from previous sessions.
+        if self.snapshot is not None:
+            row = self.snapshot.find_definition(usr)
+            if row is not None:
+                return SymbolRecord.from_row(row)
+        if self.store is not None:
+            row = self.store.find_definition(usr)
+            if row is not None:
+                return SymbolRecord.from_row(row)
 
         # Fall back on a declaration, if it can be found.
-        return cursor.referenced
+        return SymbolRecord.from_cursor(referenced, usr)
+
+
+def create_index(index_path='', snapshot_path='', build_dir='',
+                 ast_cache_dir='', max_tus=0, max_memory_mb=0, pinned=None,
+                 parse_threads=None):
+    """Create a CrossTUIndex configured from the plugin's options.
+
+    Each of the paths enables the corresponding feature if it's not empty.
+    Translation units are parsed on parse_threads threads, or one per CPU if
+    it's 0. If it's None, they're parsed on the calling thread.
+    """
+    store = None
+    if index_path != '':
+        store = symbol_store.SymbolStore(index_path)
+    snapshot = None
+    if snapshot_path != '':
+        snapshot = FlatIndex(snapshot_path)
+    flags = None
+    if build_dir != '':
+        flags = CompileFlags(ci.CompilationDatabase.fromDirectory(build_dir))
+    ast_cache = None
+    if ast_cache_dir != '':
+        ast_cache = AstCache(ast_cache_dir)
+    pool = None
+    if parse_threads is not None:
+        pool = ParsePool(parse_threads)
+    return CrossTUIndex(store, snapshot, flags, ast_cache,
+                        max_tus=max_tus, max_bytes=max_memory_mb << 20,
+                        pinned=pinned, pool=pool)
@@ -0,0 +1,189 @@
+"""Compile arguments for source files, taken from a compilation database."""
+import os.path
+
+# Arguments which do not affect the AST, along with how many values follow
+# them.
+IGNORED_ARGUMENTS = {
+    '-c': 0,
+    '-o': 1,
+    '-M': 0,
+    '-MM': 0,
+    '-MD': 0,
+    '-MMD': 0,
+    '-MG': 0,
+    '-MP': 0,
+    '-MF': 1,
+    '-MT': 1,
+    '-MQ': 1,
+}
+
+
+# Options starting with -o which aren't -o with the output file attached.
+NOT_OUTPUT_PREFIXES = ('-objc', '-object')
+
+
+def is_output_argument(arg):
+    """Return whether an argument names an output file."""
+    if arg.startswith('-MF'):
+        return True
+    return arg.startswith('-o') and not arg.startswith(NOT_OUTPUT_PREFIXES)
+
+
+# Arguments whose value is a path, which may be relative to the directory the
+# compiler was run in. Arguments attached to their value are matched by
+# prefix in this order, so options come before any option they start with.
+PATH_ARGUMENTS = ['-I', '-isystem', '-iquote', '-idirafter', '-include-pch',
+                  '-include', '-imacros', '-isysroot', '--sysroot', '-F']
+
+
+def make_absolute(arg, value, directory):
+    """Return the argument with a relative path value made absolute."""
+    if os.path.isabs(value):
+        return arg + value
+    return arg + os.path.normpath(os.path.join(directory, value))
+
+
+def command_filename(cmd):
+    """Return the absolute path of the file compiled by a CompileCommand."""
+    return os.path.normpath(os.path.join(cmd.directory, cmd.filename))
+
+
+def arguments_for_command(cmd):
+    """Return the arguments to parse the file of a CompileCommand with.
+
+    The compiler, the input file and any output options are dropped, and
+    relative paths are made absolute, so the arguments can be used from any
+    directory.
+    """
+    directory = cmd.directory
+    filename = command_filename(cmd)
+    arguments = list(cmd.arguments)[1:]
+    result = []
+    skip = 0
+    path_follows = False
+    for arg in arguments:
+        if skip:
+            skip -= 1
+            continue
+        if path_follows:
+            result.append(make_absolute('', arg, directory))
+            path_follows = False
+            continue
+        if arg == '--':
+            # Only input files follow.
+            break
+        if arg in IGNORED_ARGUMENTS:
+            skip = IGNORED_ARGUMENTS[arg]
+            continue
+        if is_output_argument(arg):
+            continue
+        if arg in PATH_ARGUMENTS:
+            result.append(arg)
+            path_follows = True
+            continue
+        for prefix in PATH_ARGUMENTS:
+            if arg.startswith(prefix) and len(arg) > len(prefix):
+                value = arg[len(prefix):]
+                if value.startswith('='):
+                    prefix += '='
+                    value = value[1:]
+                arg = make_absolute(prefix, value, directory)
+                break
+        else:
+            if (not arg.startswith('-') and
+                    os.path.normpath(os.path.join(directory, arg)) ==
+                    filename):
+                continue
+        result.append(arg)
+    return tuple(result)
+
+
+# Source file extensions, and the language to parse a header with when it
+# borrows the arguments of a source file with that extension.
+SOURCE_LANGUAGES = {
+    '.c': 'c-header',
+    '.cc': 'c++-header',
+    '.cp': 'c++-header',
+    '.cpp': 'c++-header',
+    '.cxx': 'c++-header',
+    '.c++': 'c++-header',
+    '.m': 'objective-c-header',
+    '.mm': 'objective-c++-header',
+}
+
+
+class CompileFlags:
+    """Look up and cache the arguments to parse each file with.
+
+    Headers usually have no entry in the compilation database, so they borrow
+    the arguments of a source file with the same name, or failing that of any
+    source file in the same directory.
+
+    Argument vectors are normalized to tuples and interned, so all files
+    compiled with the same flags share one object.
+    """
+
+    def __init__(self, cdb):
+        self.cdb = cdb
+        self.arguments_by_file = dict()
+        self.interned = dict()
+        self.sources_by_directory = None
+
+    def intern(self, args):
+        """Return the shared instance of an argument vector."""
+        args = tuple(args)
+        return self.interned.setdefault(args, args)
+
+    def arguments(self, filename):
+        """Return the arguments for a file, or None if there are none."""
+        filename = os.path.abspath(filename)
+        try:
+            return self.arguments_by_file[filename]
+        except KeyError:
+            pass
+
+        args = self.lookup(filename)
+        if args is None:
+            args = self.lookup_header(filename)
+        if args is not None:
+            args = self.intern(args)
+        self.arguments_by_file[filename] = args
+        return args
+
+    def lookup(self, filename):
+        """Return the arguments from the database entry for a file."""
+        commands = self.cdb.getCompileCommands(filename)
+        if commands is None or len(commands) == 0:
+            return None
+        return arguments_for_command(commands[0])
+
+    def lookup_header(self, filename):
+        """Return the arguments borrowed from a source file for a header."""
+        stem, ext = os.path.splitext(filename)
+        if ext in SOURCE_LANGUAGES:
+            return None
+
+        candidates = [stem + source_ext for source_ext in SOURCE_LANGUAGES]
+        candidates += self.sources_in_directory(os.path.dirname(filename))
+        for candidate in candidates:
+            args = self.lookup(candidate)
+            if args is not None:
+                _, source_ext = os.path.splitext(candidate)
+                return args + ('-x', SOURCE_LANGUAGES[source_ext])
+        return None
+
+    def sources_in_directory(self, directory):
+        """Return the files in the database that are in a directory."""
+        if self.sources_by_directory is None:
+            self.sources_by_directory = dict()
+            commands = self.cdb.getAllCompileCommands()
+            for cmd in commands or []:
+                source = command_filename(cmd)
+                _, ext = os.path.splitext(source)
+                if ext not in SOURCE_LANGUAGES:
+                    continue
+                sources = self.sources_by_directory.setdefault(
+                    os.path.dirname(source), [])
+                if source not in sources:
+                    sources.append(source)
+        return self.sources_by_directory.get(directory, [])
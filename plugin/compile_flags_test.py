@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from compile_flags import CompileFlags, arguments_for_command
+import clang.cindex as ci
+
+
+class FakeCommand(object):
+    """A stand-in for a CompileCommand from a compilation database."""
+
+    def __init__(self, directory, filename, arguments):
+        self.directory = directory
+        self.filename = filename
+        self.arguments = arguments
+
+
+class TestCompileFlags(unittest.TestCase):
+    def setUp(self):
+        if not ci.Config.loaded:
+            ci.Config.set_library_path('clang/lib')
+        self.build_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.abspath('test/find-defn')
+        commands = []
+        for source in ['test.cpp', 'print.cpp']:
+            commands.append({
+                'directory': self.source_dir,
+                'command': 'c++ -DFOO -I../include -c {} -o out.o'.format(
+                    source),
+                'file': source,
+            })
+        with open(os.path.join(self.build_dir, 'compile_commands.json'),
+                  'w') as f:
+            json.dump(commands, f)
+        cdb = ci.CompilationDatabase.fromDirectory(self.build_dir)
+        self.flags = CompileFlags(cdb)
+
+    def tearDown(self):
+        shutil.rmtree(self.build_dir)
+
+    def test_source_arguments(self):
+        """Arguments are normalized, with output options removed."""
+        args = self.flags.arguments('test/find-defn/test.cpp')
+        self.assertIn('-DFOO', args)
+        self.assertIn('-I' + os.path.abspath('test/include'), args)
+        self.assertNotIn('-c', args)
+        self.assertNotIn('-o', args)
+        self.assertNotIn(os.path.join(self.source_dir, 'test.cpp'), args)
+
+    def test_path_arguments(self):
+        """Relative paths are made absolute, however they're passed."""
+        args = arguments_for_command(FakeCommand(
+            self.source_dir, 'test.cpp',
+            ['c++', '-include-pch', 'pch/all.pch', '-includeconfig.h',
+             '-isystem', 'sys', '--sysroot=root', 'test.cpp']))
+        self.assertEqual(args, (
+            '-include-pch', os.path.join(self.source_dir, 'pch/all.pch'),
+            '-include' + os.path.join(self.source_dir, 'config.h'),
+            '-isystem', os.path.join(self.source_dir, 'sys'),
+            '--sysroot=' + os.path.join(self.source_dir, 'root')))
+
+    def test_output_arguments(self):
+        """Only output files are dropped, not every option starting -o."""
+        args = arguments_for_command(FakeCommand(
+            self.source_dir, 'test.cpp',
+            ['c++', '-ooutput.o', '-objcmt-migrate-literals', '-MFdeps.d',
+             '-o', 'out.o', 'test.cpp']))
+        self.assertEqual(args, ('-objcmt-migrate-literals',))
+
+    def test_shared_arguments(self):
+        """Files compiled with the same flags share one argument vector."""
+        self.assertIs(self.flags.arguments('test/find-defn/test.cpp'),
+                      self.flags.arguments('test/find-defn/print.cpp'))
+
+    def test_header_arguments(self):
+        """Headers are given the arguments of a nearby source file."""
+        args = self.flags.arguments('test/find-defn/test.h')
+        self.assertIsNotNone(args)
+        self.assertIn('-DFOO', args)
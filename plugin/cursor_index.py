@@ -0,0 +1,162 @@
+"""An interval index of the cursors in one file of a translation unit.
+
+Finding the cursor at a position with libclang reads extents one call at a
+time. When the same unchanged translation unit is queried repeatedly, it's
+cheaper to read every extent in the file once into flat arrays, and answer
+each query by bisection without calling into libclang at all. Only the
+extents are kept, since every Cursor would keep the translation unit alive;
+the one cursor a query returns is looked up again from its start.
+
+An index is only valid for the generation of the translation unit it was
+built from, and must be dropped when the translation unit is reparsed.
+"""
+import array
+import bisect
+import os.path
+import clang.cindex as ci
+
+UNEXPOSED_EXPR = ci.CursorKind.UNEXPOSED_EXPR.value
+
+
+class CursorIndex:
+    """The extents of the cursors in a file, sorted by start offset.
+
+    Cursor i spans the offsets starts[i] to ends[i] inclusive, has the kind
+    id kinds[i], and is innermost among the cursors containing it, or -1, at
+    parents[i]. Parents are found from the extents rather than the AST, so
+    a declaration whose extent covers a preceding sibling, as a typedef does
+    the struct it names, counts as that sibling's parent.
+    """
+
+    def __init__(self, tu, filename):
+        self.filename = os.path.abspath(filename)
+        # The offset at which each line starts, from line 1.
+        self.line_starts = array.array('l')
+        entries = []
+        line_starts = dict()
+        self.collect(tu.cursor, entries, line_starts)
+
+        # Enclosing cursors come before the cursors they contain, and cursors
+        # with the same extent stay in AST order, innermost last.
+        entries.sort(key=lambda e: (e[0], -e[1], e[2]))
+        self.starts = array.array('l', (e[0] for e in entries))
+        self.ends = array.array('l', (e[1] for e in entries))
+        self.kinds = array.array('i', (e[3] for e in entries))
+        self.parents = array.array('l')
+        enclosing = []
+        for i in xrange(len(entries)):
+            while enclosing and self.ends[enclosing[-1]] < self.starts[i]:
+                enclosing.pop()
+            self.parents.append(enclosing[-1] if enclosing else -1)
+            enclosing.append(i)
+
+        last_line = max(line_starts) if line_starts else 0
+        for line in xrange(1, last_line + 1):
+            if line not in line_starts:
+                line_starts[line] = tu.get_location(filename,
+                                                    (line, 1)).offset
+            self.line_starts.append(line_starts[line])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def collect(self, cursor, entries, line_starts):
+        """Append an entry for each cursor in the file below cursor."""
+        def visitor(child, parent):
+            extent = child.extent
+            start = extent.start
+            if (start.file is None or
+                    os.path.abspath(start.file.name) != self.filename):
+                # Skip its children.
+                return 1
+            end = extent.end
+            line_starts[start.line] = start.offset - start.column + 1
+            if end.file is not None and end.file.name == start.file.name:
+                line_starts[end.line] = end.offset - end.column + 1
+            entries.append((start.offset, self.end_offset(extent),
+                            len(entries), child._kind_id))
+            # Recurse.
+            return 2
+
+        cursor.visit(visitor)
+
+    def end_offset(self, extent):
+        """Return the offset an extent ends at in its own file."""
+        end = extent.end
+        if end.file is None or end.file.name != extent.start.file.name:
+            return extent.start.offset
+        return end.offset
+
+    def matches(self, cursor, i):
+        """Return whether a cursor is cursor i."""
+        if cursor is None or cursor._kind_id != self.kinds[i]:
+            return False
+        extent = cursor.extent
+        return (extent.start.offset == self.starts[i] and
+                self.end_offset(extent) == self.ends[i])
+
+    def cursor(self, tu, i):
+        """Return cursor i, from the translation unit the index was built from.
+
+        libclang returns the innermost cursor at a location, which is cursor
+        i unless a cursor inside it starts at the same offset, as the callee
+        of a call does. Then cursor i is found by descending the AST to it.
+        """
+        start, end = self.starts[i], self.ends[i]
+        location = ci.SourceLocation.from_offset(
+            tu, ci.File.from_name(tu, self.filename), start)
+        cursor = ci.Cursor.from_location(tu, location)
+        if self.matches(cursor, i):
+            return cursor
+
+        cursor = tu.cursor
+        while True:
+            for child in cursor.get_children():
+                extent = child.extent
+                if (extent.start.file is None or
+                        os.path.abspath(extent.start.file.name) !=
+                        self.filename):
+                    continue
+                if (extent.start.offset <= start and
+                        end <= self.end_offset(extent)):
+                    if self.matches(child, i):
+                        return child
+                    cursor = child
+                    break
+            else:
+                return None
+
+    def offset(self, line, column):
+        """Return the offset of a position, or None if it's past the end."""
+        if line < 1 or line > len(self.line_starts):
+            return None
+        offset = self.line_starts[line - 1] + column - 1
+        if line < len(self.line_starts):
+            offset = min(offset, self.line_starts[line] - 1)
+        return offset
+
+    def innermost(self, offset):
+        """Return the index of the innermost cursor containing an offset.
+
+        Unexposed expressions are skipped in favour of the cursor around
+        them. Return -1 if no cursor contains it.
+        """
+        i = bisect.bisect_right(self.starts, offset) - 1
+        while i >= 0 and (self.ends[i] < offset or
+                          self.kinds[i] == UNEXPOSED_EXPR):
+            i = self.parents[i]
+        return i
+
+    def cursor_at(self, tu, line, column):
+        """Return the innermost cursor containing a position, or None.
+
+        This finds the same cursor as get_smallest_cursor_containing in the
+        translation unit the index was built from.
+        """
+        offset = self.offset(line, column)
+        if offset is None:
+            return None
+        i = self.innermost(offset)
+        if i < 0:
+            return None
+        return self.cursor(tu, i)
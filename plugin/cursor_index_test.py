@@ -0,0 +1,47 @@
+import unittest
+from clang_tools import get_smallest_cursor_containing
+from cursor_index import CursorIndex
+from test_util import node
+import clang.cindex as ci
+
+
+class TestCursorIndex(unittest.TestCase):
+    def setUp(self):
+        if not ci.Config.loaded:
+            ci.Config.set_library_path('clang/lib')
+        self.filename = 'test/find-defn/test.cpp'
+        self.tu = ci.Index.create().parse(self.filename)
+        self.cursors = CursorIndex(self.tu, self.filename)
+
+    def test_matches_descent(self):
+        """The index finds the same cursors as descending the AST."""
+        with open(self.filename) as f:
+            lines = f.read().splitlines()
+        for line, text in enumerate(lines, 1):
+            for col in xrange(1, len(text) + 1):
+                loc = self.tu.get_location(self.filename, (line, col))
+                expected = get_smallest_cursor_containing(self.tu.cursor, loc)
+                if expected == self.tu.cursor:
+                    expected = None
+                cursor = self.cursors.cursor_at(self.tu, line, col)
+                if expected is None:
+                    self.assertIsNone(cursor)
+                else:
+                    self.assertEqual(node(cursor), node(expected))
+
+    def test_parents(self):
+        """The cursors containing a position can be followed outwards."""
+        # The call to 'in_other_tu()' in 'main'.
+        i = self.cursors.innermost(self.cursors.offset(7, 2))
+        self.assertEqual(self.cursors.cursor(self.tu, i).referenced.spelling,
+                         'in_other_tu')
+        kinds = []
+        while i >= 0:
+            kinds.append(ci.CursorKind.from_id(self.cursors.kinds[i]))
+            i = self.cursors.parents[i]
+        self.assertEqual(kinds[-2:], [ci.CursorKind.COMPOUND_STMT,
+                                      ci.CursorKind.FUNCTION_DECL])
+
+    def test_past_end(self):
+        self.assertIsNone(self.cursors.cursor_at(self.tu, 100, 1))
+        self.assertIsNone(self.cursors.cursor_at(self.tu, 0, 1))
@@ -0,0 +1,212 @@
+"""A columnar table of every cursor in a translation unit.
+
+The table is filled in a single clang_visitChildren pass, reading only what
+each column needs with the fewest calls into libclang. Each column is an
+array.array, so there's no Python object per cursor, and filtering or
+aggregating over the whole translation unit never calls into libclang. The
+arrays support the buffer protocol, so numpy.frombuffer can wrap them
+without copying.
+
+Filenames and USRs are interned in string pools, and stored as ids into
+them.
+"""
+import array
+import ctypes
+import os.path
+import sys
+import clang.cindex as ci
+
+
+class CursorTable:
+    """Columns describing the cursors below a cursor, in preorder.
+
+    For the cursor in row i:
+      kinds[i]        its CursorKind id.
+      parents[i]      the row of its parent, or -1 below the root.
+      starts[i]       the offset of the start of its extent.
+      ends[i]         the offset of the end of its extent, in the file it
+                      ends in.
+      lines[i]        the line and column of the start of its extent.
+      columns[i]
+      files[i]        the id of the file it starts in, or -1.
+      usrs[i]         the id of the USR of a declaration, or -1.
+      definitions[i]  1 if it's a definition, or 0.
+    """
+
+    def __init__(self, cursor):
+        self.kinds = array.array('i')
+        self.parents = array.array('l')
+        self.starts = array.array('l')
+        self.ends = array.array('l')
+        self.lines = array.array('l')
+        self.columns = array.array('l')
+        self.files = array.array('i')
+        self.usrs = array.array('l')
+        self.definitions = array.array('B')
+        # The string pools, and the id of each string in them.
+        self.filenames = []
+        self.usr_strings = []
+        self.file_ids = dict()
+        self.usr_ids = dict()
+        self.fill(cursor)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def fill(self, root):
+        """Append a row for each cursor below root."""
+        lib = ci.conf.lib
+        file_ptr = ci.c_object_p()
+        line = ctypes.c_uint()
+        column = ctypes.c_uint()
+        offset = ctypes.c_uint()
+        out = (ctypes.byref(file_ptr), ctypes.byref(line),
+               ctypes.byref(column), ctypes.byref(offset))
+        # Files by the address of their CXFile, which stays the same for the
+        # life of the translation unit, and whether each kind is a
+        # declaration.
+        files_by_address = dict()
+        declaration_kinds = dict()
+        # The ancestors of the last row, as (cursor key, row) pairs. Cursors
+        # are compared by their fields, which libclang passes back unchanged
+        # as the parent of their children.
+        def key(cursor):
+            return (cursor._kind_id, cursor.xdata, cursor.data[0],
+                    cursor.data[1], cursor.data[2])
+
+        ancestors = [(key(root), -1)]
+        errors = []
+
+        def visitor(child, parent, _):
+            try:
+                add_row(child, parent)
+            except Exception:
+                errors.append(sys.exc_info())
+                return 0 # break
+            # Recurse.
+            return 2
+
+        def add_row(child, parent):
+            # Every value of the row is read before any column is appended
+            # to, so the columns stay the same length if reading fails.
+            row = len(self.kinds)
+            parent_key = key(parent)
+            for depth in xrange(len(ancestors) - 1, -1, -1):
+                if ancestors[depth][0] == parent_key:
+                    del ancestors[depth + 1:]
+                    break
+            else:
+                # libclang visits the children of some cursors it doesn't
+                # report, such as implicit expressions. Count them as
+                # children of the last cursor reported.
+                ancestors.append((parent_key, ancestors[-1][1]))
+            parent_row = ancestors[-1][1]
+            kind_id = child._kind_id
+
+            extent = lib.clang_getCursorExtent(child)
+            lib.clang_getInstantiationLocation(
+                lib.clang_getRangeEnd(extent), *out)
+            end = offset.value
+            lib.clang_getInstantiationLocation(
+                lib.clang_getRangeStart(extent), *out)
+            start = offset.value
+            start_line = line.value
+            start_column = column.value
+            file_id = -1
+            if file_ptr:
+                address = ctypes.cast(file_ptr, ctypes.c_void_p).value
+                file_id = files_by_address.get(address)
+                if file_id is None:
+                    file_id = self.intern_file(ci.File(file_ptr).name)
+                    files_by_address[address] = file_id
+
+            is_declaration = declaration_kinds.get(kind_id)
+            if is_declaration is None:
+                # By id, so kinds these bindings don't know are handled too.
+                is_declaration = lib.clang_isDeclaration(kind_id)
+                declaration_kinds[kind_id] = is_declaration
+            usr_id = -1
+            definition = 0
+            if is_declaration:
+                usr = lib.clang_getCursorUSR(child)
+                if usr:
+                    usr_id = self.intern_usr(usr)
+                definition = int(lib.clang_isCursorDefinition(child))
+
+            self.kinds.append(kind_id)
+            self.parents.append(parent_row)
+            self.starts.append(start)
+            self.ends.append(end)
+            self.lines.append(start_line)
+            self.columns.append(start_column)
+            self.files.append(file_id)
+            self.usrs.append(usr_id)
+            self.definitions.append(definition)
+            ancestors.append((key(child), row))
+
+        lib.clang_visitChildren(root, ci.callbacks['cursor_visit'](visitor),
+                                None)
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+
+    def intern_file(self, filename):
+        """Return the id of a filename, adding it to the pool if needed."""
+        try:
+            return self.file_ids[filename]
+        except KeyError:
+            self.file_ids[filename] = len(self.filenames)
+            self.filenames.append(filename)
+            return self.file_ids[filename]
+
+    def intern_usr(self, usr):
+        """Return the id of a USR, adding it to the pool if needed."""
+        try:
+            return self.usr_ids[usr]
+        except KeyError:
+            self.usr_ids[usr] = len(self.usr_strings)
+            self.usr_strings.append(usr)
+            return self.usr_ids[usr]
+
+    def file_id(self, filename):
+        """Return the id of a file, or -1 if no cursor is in it."""
+        filename = os.path.abspath(filename)
+        for file_id, name in enumerate(self.filenames):
+            if os.path.abspath(name) == filename:
+                return file_id
+        return -1
+
+    def select(self, kinds=None, filename=None, definitions=None):
+        """Return the rows of the cursors matching every given condition.
+
+        kinds is a collection of CursorKinds, filename restricts the rows to
+        cursors starting in that file, and definitions to definitions if it's
+        True or to other cursors if it's False.
+        """
+        rows = xrange(len(self))
+        if kinds is not None:
+            kind_ids = frozenset(kind.value for kind in kinds)
+            column = self.kinds
+            rows = [i for i in rows if column[i] in kind_ids]
+        if filename is not None:
+            file_id = self.file_id(filename)
+            column = self.files
+            rows = [i for i in rows if column[i] == file_id]
+        if definitions is not None:
+            wanted = int(bool(definitions))
+            column = self.definitions
+            rows = [i for i in rows if column[i] == wanted]
+        return list(rows)
+
+    def usr(self, row):
+        """Return the USR of the cursor in a row, or None."""
+        usr_id = self.usrs[row]
+        if usr_id < 0:
+            return None
+        return self.usr_strings[usr_id]
+
+    def filename(self, row):
+        """Return the file the cursor in a row starts in, or None."""
+        file_id = self.files[row]
+        if file_id < 0:
+            return None
+        return self.filenames[file_id]
@@ -0,0 +1,67 @@
+import os.path
+import unittest
+from clang_tools import export_cursor_table, find_all_definitions
+import clang.cindex as ci
+
+
+class TestCursorTable(unittest.TestCase):
+    def setUp(self):
+        if not ci.Config.loaded:
+            ci.Config.set_library_path('clang/lib')
+        self.filename = 'test/find-defn/test.cpp'
+        self.tu = ci.Index.create().parse(self.filename)
+        self.table = export_cursor_table(self.tu.cursor)
+
+    def test_definitions_in_file(self):
+        rows = self.table.select(kinds=[ci.CursorKind.FUNCTION_DECL],
+                                 filename=self.filename, definitions=True)
+        self.assertEqual([self.table.usr(row) for row in rows],
+                         ['c:@F@main#I#**C#', 'c:@F@in_this_tu#'])
+        self.assertEqual([(self.table.lines[row], self.table.columns[row])
+                          for row in rows], [(6, 1), (14, 1)])
+
+    def test_same_definitions_as_visiting(self):
+        """The table holds every definition find_all_definitions finds."""
+        usrs = set(self.table.usr(row)
+                   for row in self.table.select(definitions=True))
+        expected = set(find_all_definitions(self.tu.cursor))
+        expected.discard('')
+        self.assertEqual(usrs - set([None]), expected)
+
+    def test_parents_contain_children(self):
+        file_id = self.table.file_id(self.filename)
+        rows = self.table.select(filename=self.filename)
+        self.assertTrue(rows)
+        for row in rows:
+            parent = self.table.parents[row]
+            if parent < 0:
+                continue
+            self.assertEqual(self.table.files[parent], file_id)
+            self.assertLessEqual(self.table.starts[parent],
+                                 self.table.starts[row])
+            self.assertGreaterEqual(self.table.ends[parent],
+                                    self.table.ends[row])
+
+    def test_strings_interned(self):
+        self.assertEqual(len(set(self.table.filenames)),
+                         len(self.table.filenames))
+        self.assertEqual(len(set(self.table.usr_strings)),
+                         len(self.table.usr_strings))
+        self.assertEqual(
+            self.table.filename(self.table.select(
+                filename=os.path.abspath(self.filename))[0]),
+            self.filename)
+
+    def test_columns_same_length(self):
+        for column in (self.table.kinds, self.table.parents,
+                       self.table.starts, self.table.ends, self.table.lines,
+                       self.table.columns, self.table.files, self.table.usrs,
+                       self.table.definitions):
+            self.assertEqual(len(column), len(self.table))
+
+    def test_unknown_kind_declaration(self):
+        """Kinds these bindings don't know can still be passed by id."""
+        self.assertTrue(ci.conf.lib.clang_isDeclaration(
+            ci.CursorKind.FUNCTION_DECL.value))
+        self.assertFalse(ci.conf.lib.clang_isDeclaration(
+            ci.CursorKind.CALL_EXPR.value))
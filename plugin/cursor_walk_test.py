@@ -0,0 +1,86 @@
+import unittest
+import clang.cindex as ci
+
+
+class TestCursorWalk(unittest.TestCase):
+    def setUp(self):
+        if not ci.Config.loaded:
+            ci.Config.set_library_path('clang/lib')
+        self.test_file = 'test/find-defn/test.cpp'
+        self.tu = ci.Index.create().parse(self.test_file)
+
+    def in_other_file(self, cursor):
+        return (cursor.location.file is not None and
+                cursor.location.file.name != self.test_file)
+
+    def test_walk_preorder(self):
+        """Pruned subtrees are skipped, and everything else is visited."""
+        walked = [c for c in self.tu.cursor.walk_preorder(
+            prune=self.in_other_file) if not self.in_other_file(c)]
+        self.assertEqual(walked[0], self.tu.cursor)
+        # Not every kind in the walk is known to the bindings.
+        kinds = [c._kind_id for c in walked]
+        self.assertEqual(kinds.count(ci.CursorKind.FUNCTION_DECL.value), 3)
+        self.assertEqual(kinds.count(ci.CursorKind.CALL_EXPR.value), 4)
+
+        visited = []
+
+        def visitor(child, parent):
+            if self.in_other_file(child):
+                return 1
+            visited.append(child._kind_id)
+            return 2
+
+        self.assertFalse(self.tu.cursor.visit(visitor))
+        self.assertEqual(visited, kinds[1:])
+
+    def test_stop(self):
+        walk = self.tu.cursor.walk_preorder()
+        next(walk)
+        next(walk)
+        walk.close()
+
+        visited = []
+
+        def visitor(child, parent):
+            visited.append(child)
+            return 0
+
+        self.assertTrue(self.tu.cursor.visit(visitor))
+        self.assertEqual(len(visited), 1)
+
+    def test_visitor_exception(self):
+        def visitor(child, parent):
+            raise KeyError(child.kind)
+
+        self.assertRaises(KeyError, self.tu.cursor.visit, visitor)
+
+    def test_find_descendants(self):
+        """Only cursors of the given kinds are returned."""
+        kinds = frozenset([ci.CursorKind.FUNCTION_DECL.value,
+                           ci.CursorKind.CALL_EXPR.value])
+        found = [c for c in self.tu.cursor.find_descendants(kinds)
+                 if not self.in_other_file(c)]
+        self.assertEqual([c.kind for c in found],
+                         [ci.CursorKind.FUNCTION_DECL] * 2 +
+                         [ci.CursorKind.CALL_EXPR] * 4 +
+                         [ci.CursorKind.FUNCTION_DECL])
+        self.assertEqual(found[0].translation_unit, self.tu)
+
+        found = [c for c in self.tu.cursor.find_descendants(
+            kinds, skip_bodies=True) if not self.in_other_file(c)]
+        self.assertEqual([c.kind for c in found],
+                         [ci.CursorKind.FUNCTION_DECL] * 3)
+
+    def test_visit_kinds_exception(self):
+        def callback(cursor):
+            raise KeyError(cursor.kind)
+
+        self.assertRaises(KeyError, self.tu.cursor.visit_kinds,
+                          frozenset([ci.CursorKind.FUNCTION_DECL.value]),
+                          callback)
+
+    def test_is_null(self):
+        self.assertTrue(ci.conf.lib.clang_getNullCursor().is_null())
+        self.assertFalse(self.tu.cursor.is_null())
+        self.assertFalse(next(self.tu.cursor.get_children()).is_null())
@@ -1,5 +1,11 @@
+import collections
+import os.path
 import unittest
-from clang_tools import CrossTUIndex
+from clang_tools import (ChangeTracker, CrossTUIndex, SymbolRecord,
+                         find_all_definitions, find_cursor_at_pos,
+                         get_cursors_containing,
+                         get_smallest_cursor_containing)
+from test_util import node
 import clang.cindex as ci
 
 
@@ -14,6 +20,10 @@ class TestFindDefinition(unittest.TestCase):
         self.print_tu = self.index.get_or_parse_tu(self.print_file)
         self.test_h_file = 'test/find-defn/test.h'
 
+    def assertSameFile(self, first, second):
+        # Files in a precompiled preamble are reported with absolute paths.
+        self.assertEqual(os.path.abspath(first), os.path.abspath(second))
+
     def test_other_tu(self):
         """Find the definition of a symbol from another translation unit."""
         # Search for the definition of the function 'in_other_tu()'.
@@ -21,9 +31,58 @@ class TestFindDefinition(unittest.TestCase):
                                           line=7,
                                           col=9)
         self.assertIsNotNone(defn)
+        self.assertIsInstance(defn, SymbolRecord)
         self.assertEqual(defn.displayname, 'in_other_tu()')
-        self.assertTrue(defn.is_definition())
-        self.assertEqual(defn.location.file.name, self.print_file)
+        self.assertEqual(defn.kind, ci.CursorKind.FUNCTION_DECL)
+        # The other translation unit was parsed without function bodies, but
+        # this is still its definition.
+        self.assertEqual((defn.line, defn.column), (4, 6))
+        self.assertEqual(defn.filename, self.print_file)
+
+    def test_upgrade_active_tu(self):
+        """The active translation unit is parsed again with a full AST."""
+        self.assertTrue(self.index.skipped_bodies(self.print_file))
+        self.index.set_active(self.print_file)
+        self.assertFalse(self.index.skipped_bodies(self.print_file))
+        self.assertTrue(self.index.skipped_bodies(self.test_file))
+
+    def test_skipped_body_in_unsaved_file(self):
+        """Skipped bodies are found in the contents a file was parsed with."""
+        filename = os.path.abspath('test/find-defn/unsaved.cpp')
+        tu = ci.Index.create().parse(
+            filename, unsaved_files=[
+                (filename, 'void declared();\nvoid defined() {}\n')],
+            options=ci.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES)
+        self.assertEqual(find_all_definitions(tu.cursor, True).keys(),
+                         ['c:@F@defined#'])
+
+    def test_preamble_reused(self):
+        """Reparsing the active translation unit reuses its preamble."""
+        self.index.set_active(self.test_file)
+        self.index.reparse_tu(self.test_file)
+        self.index.reparse_tu(self.test_file)
+        self.assertEqual(self.index.preamble_hits, 2)
+        self.assertEqual(self.index.preamble_misses, 0)
+
+    def test_preamble_rebuilt(self):
+        """A preamble rebuilt because a header changed isn't reused."""
+        self.index.set_active(self.test_file)
+        with open(self.test_h_file) as f:
+            contents = f.read() + 'int changed_header;\n'
+        unsaved_files = [(os.path.abspath(self.test_h_file), contents)]
+        self.index.reparse_tu(self.test_file, unsaved_files)
+        self.assertEqual(self.index.preamble_misses, 1)
+        self.index.reparse_tu(self.test_file, unsaved_files)
+        self.assertEqual(self.index.preamble_hits, 1)
+
+    def test_background_without_preamble(self):
+        """Only the active translation unit keeps a preamble."""
+        self.index.set_active(self.test_file)
+        self.assertIn(self.test_file, self.index.preamble_states)
+        self.assertNotIn(self.print_file, self.index.preamble_states)
+        self.index.reparse_tu(self.print_file)
+        self.assertEqual(self.index.preamble_hits, 0)
+        self.assertEqual(self.index.preamble_misses, 0)
 
     def test_same_tu(self):
         """Find the definition of a symbol from the same translation unit."""
@@ -33,8 +92,8 @@ class TestFindDefinition(unittest.TestCase):
                                           col=2)
         self.assertIsNotNone(defn)
         self.assertEqual(defn.displayname, 'in_this_tu()')
-        self.assertTrue(defn.is_definition())
-        self.assertEqual(defn.location.file.name, self.test_file)
+        self.assertEqual((defn.line, defn.column), (14, 6))
+        self.assertEqual(defn.filename, self.test_file)
 
     def test_inline_header(self):
         """Find the definition of an inline function from a header."""
@@ -44,8 +103,8 @@ class TestFindDefinition(unittest.TestCase):
                                           col=2)
         self.assertIsNotNone(defn)
         self.assertEqual(defn.displayname, 'inline_header()')
-        self.assertTrue(defn.is_definition())
-        self.assertEqual(defn.location.file.name, self.test_h_file)
+        self.assertEqual((defn.line, defn.column), (7, 13))
+        self.assertSameFile(defn.filename, self.test_h_file)
 
     def test_static_header(self):
         """Find the definition of a static function from a header."""
@@ -55,5 +114,234 @@ class TestFindDefinition(unittest.TestCase):
                                           col=2)
         self.assertIsNotNone(defn)
         self.assertEqual(defn.displayname, 'static_header()')
-        self.assertTrue(defn.is_definition())
-        self.assertEqual(defn.location.file.name, self.test_h_file)
+        self.assertEqual((defn.line, defn.column), (11, 13))
+        self.assertSameFile(defn.filename, self.test_h_file)
+
+    def test_other_tu_after_reparse(self):
+        """Find a definition from another TU after that TU was reparsed."""
+        self.index.reparse_tu(self.print_file)
+        defn = self.index.find_definition(self.test_file,
+                                          line=7,
+                                          col=9)
+        self.assertIsNotNone(defn)
+        self.assertEqual(defn.displayname, 'in_other_tu()')
+        self.assertEqual(defn.filename, self.print_file)
+
+    def test_dirty_tus(self):
+        """Only translation units including a changed file are dirty."""
+        test_h = os.path.abspath(self.test_h_file)
+        self.assertEqual(set(self.index.dirty_tus([test_h])),
+                         set([self.test_file, self.print_file]))
+        self.assertEqual(
+            self.index.dirty_tus([os.path.abspath(self.print_file)]),
+            [self.print_file])
+        self.assertEqual(self.index.dirty_tus([]), [])
+
+    def test_tu_unsaved_files(self):
+        """A translation unit only gets the unsaved files it includes."""
+        unsaved_files = [(os.path.abspath(self.test_h_file), ''),
+                         (os.path.abspath(self.print_file), ''),
+                         ('/nonexistent/other.h', '')]
+        self.assertEqual(
+            self.index.tu_unsaved_files(self.test_file, unsaved_files),
+            unsaved_files[:1])
+        self.assertEqual(
+            self.index.tu_unsaved_files(self.print_file, unsaved_files),
+            unsaved_files[:2])
+
+    def test_smallest_cursor_matches_exhaustive_search(self):
+        """The descent finds the same cursor as checking every cursor."""
+        with open(self.test_file) as f:
+            lines = f.read().splitlines()
+        for line, text in enumerate(lines, 1):
+            for col in xrange(1, len(text) + 1):
+                loc = self.test_tu.get_location(self.test_file, (line, col))
+                cursors = get_cursors_containing(self.test_tu.cursor, loc)
+                expected = min(cursors, key=lambda c: (c.extent.end.offset -
+                                                       c.extent.start.offset))
+                self.assertEqual(
+                    node(get_smallest_cursor_containing(self.test_tu.cursor,
+                                                        loc)),
+                    node(expected))
+
+    def test_cursor_lookups(self):
+        """Cursors are found by libclang, falling back on a descent."""
+        self.index.set_active(self.test_file)
+        tu = self.index.get_or_parse_tu(self.test_file)
+        lookups = collections.Counter()
+        # The call to 'in_this_tu()'.
+        cursor = find_cursor_at_pos(tu, self.test_file, 8, 2, lookups)
+        self.assertEqual(cursor.referenced.spelling, 'in_this_tu')
+        self.assertEqual(lookups, {'cursor': 1})
+        # The '<<' operator, which libclang doesn't expose.
+        cursor = find_cursor_at_pos(tu, self.test_file, 15, 12, lookups)
+        loc = tu.get_location(self.test_file, (15, 12))
+        self.assertEqual(cursor,
+                         get_smallest_cursor_containing(tu.cursor, loc))
+        self.assertEqual(lookups, {'cursor': 1, 'descent': 1})
+
+        self.index.find_definition(self.test_file, line=7, col=9)
+        self.assertEqual(self.index.stats()['cursor_lookups'], 1)
+
+    def test_interval_lookups(self):
+        """Repeated queries on the same parse use a CursorIndex."""
+        for _ in xrange(3):
+            defn = self.index.find_definition(self.test_file, line=8, col=2)
+            self.assertEqual(defn.displayname, 'in_this_tu()')
+        self.assertEqual(self.index.lookups['interval'], 2)
+        self.assertIn(self.test_file, self.index.cursor_indexes)
+        self.index.reparse_tu(self.test_file)
+        self.assertNotIn(self.test_file, self.index.cursor_indexes)
+        defn = self.index.find_definition(self.test_file, line=8, col=2)
+        self.assertEqual(defn.displayname, 'in_this_tu()')
+        self.assertEqual(self.index.lookups['interval'], 2)
+
+    def test_interval_misses(self):
+        """A cursor from the index referring to nothing is looked up again."""
+        for _ in xrange(2):
+            self.assertIsNone(
+                self.index.find_definition(self.test_file, line=11, col=2))
+        stats = self.index.stats()
+        self.assertEqual(stats['interval_lookups'], 0)
+        self.assertEqual(stats['interval_misses'], 1)
+        self.assertEqual(stats['descent_lookups'], 2)
+
+
+class TestChangeTracker(unittest.TestCase):
+    def test_update(self):
+        changes = ChangeTracker()
+        self.assertFalse(changes.update('a.cpp', (1, 10.0)))
+        self.assertTrue(changes.update('b.cpp', (1, 10.0), modified=True))
+        self.assertFalse(changes.update('a.cpp', (1, 10.0)))
+        self.assertTrue(changes.update('a.cpp', (2, 10.0)))
+        self.assertTrue(changes.update('a.cpp', (2, 11.0)))
+        changes.forget('a.cpp')
+        self.assertFalse(changes.update('a.cpp', (2, 11.0)))
+
+
+class TestSymbolRecord(unittest.TestCase):
+    def test_immutable(self):
+        record = SymbolRecord.from_row(('c:@F@f#', 'a.cpp', 1, 6, 'f()'))
+        self.assertRaises(AttributeError, setattr, record, 'line', 2)
+        self.assertRaises(AttributeError, setattr, record, 'other', 2)
+        self.assertEqual(record.filename, 'a.cpp')
+        self.assertIsNone(record.kind)
+
+    def test_filenames_interned(self):
+        first = SymbolRecord.from_row(('c:@F@f#', 'a.cpp', 1, 6, 'f()'))
+        second = SymbolRecord.from_row(('c:@F@g#', 'a.cpp', 2, 6, 'g()'))
+        self.assertEqual(first.file_id, second.file_id)
+        self.assertEqual(
+            first, SymbolRecord.from_row(('c:@F@f#', 'a.cpp', 1, 6, 'f()')))
+        self.assertNotEqual(first, second)
+
+
+class TestEviction(unittest.TestCase):
+    def setUp(self):
+        if not ci.Config.loaded:
+            ci.Config.set_library_path('clang/lib')
+        self.test_file = 'test/find-defn/test.cpp'
+        self.print_file = 'test/find-defn/print.cpp'
+        self.test_h_file = 'test/find-defn/test.h'
+
+    def test_evict_least_recently_used(self):
+        """Loading more translation units than allowed evicts the oldest."""
+        index = CrossTUIndex(max_tus=2)
+        index.parse_tu(self.test_file)
+        index.parse_tu(self.print_file)
+        index.get_or_parse_tu(self.test_file)
+        index.parse_tu(self.test_h_file)
+        self.assertEqual(set(index.tus), set([self.test_file,
+                                              self.test_h_file]))
+        self.assertIn(self.print_file, index.evicted)
+
+        # The evicted translation unit is loaded again when needed.
+        defn = index.find_definition(self.print_file, line=5, col=7)
+        self.assertIsNotNone(defn)
+        self.assertNotIn(self.print_file, index.evicted)
+
+    def test_definitions_kept_after_eviction(self):
+        """Definitions from an evicted translation unit are still found."""
+        index = CrossTUIndex(max_tus=1)
+        index.parse_tu(self.print_file)
+        index.parse_tu(self.test_file)
+        self.assertIn(self.print_file, index.evicted)
+        defn = index.find_definition(self.test_file, line=7, col=9)
+        self.assertEqual(defn.displayname, 'in_other_tu()')
+        self.assertEqual(defn.filename, self.print_file)
+        self.assertIn(self.print_file, index.evicted)
+
+    def test_evicted_definitions_dropped_when_modified(self):
+        """Definitions of an evicted file modified on disk are dropped."""
+        index = CrossTUIndex(max_tus=1)
+        index.parse_tu(self.print_file)
+        index.parse_tu(self.test_file)
+        self.assertEqual(index.dirty_tus([]), [])
+        self.assertIn(self.print_file, index.tu_definitions)
+
+        info = os.stat(self.print_file)
+        os.utime(self.print_file, (info.st_atime, info.st_mtime + 10))
+        try:
+            self.assertEqual(index.dirty_tus([]), [])
+        finally:
+            os.utime(self.print_file, (info.st_atime, info.st_mtime))
+        self.assertNotIn(self.print_file, index.tu_definitions)
+        self.assertIn(self.print_file, index.evicted)
+
+    def test_reparse_evicted_tu(self):
+        """An evicted translation unit is parsed once, with unsaved files."""
+        index = CrossTUIndex(max_tus=1)
+        index.parse_tu(self.print_file)
+        index.parse_tu(self.test_file)
+        self.assertIn(self.print_file, index.evicted)
+
+        reparse = ci.TranslationUnit.reparse
+        reparsed = []
+
+        def counting_reparse(tu, *args, **kwargs):
+            reparsed.append(tu)
+            return reparse(tu, *args, **kwargs)
+
+        ci.TranslationUnit.reparse = counting_reparse
+        try:
+            tu = index.reparse_tu(self.print_file,
+                                  [(self.print_file, 'int from_buffer;')])
+        finally:
+            ci.TranslationUnit.reparse = reparse
+        self.assertEqual(reparsed, [])
+        self.assertEqual([c.spelling for c in tu.cursor.get_children()
+                          if c.location.file is not None and
+                          c.location.file.name == self.print_file],
+                         ['from_buffer'])
+        self.assertNotIn(self.print_file, index.evicted)
+
+    def test_memory_usage(self):
+        """Memory usage is reported per translation unit and in total."""
+        index = CrossTUIndex()
+        index.parse_tu(self.test_file)
+        index.parse_tu(self.print_file)
+        usage = index.memory_usage()
+        self.assertEqual(set(usage), set([self.test_file, self.print_file]))
+        self.assertGreater(sum(usage[self.test_file].itervalues()), 0)
+        totals = index.total_memory_usage()
+        self.assertEqual(sum(totals.itervalues()),
+                         sum(sum(u.itervalues()) for u in usage.itervalues()))
+
+    def test_evict_over_byte_budget(self):
+        """Translation units are evicted when they use too much memory."""
+        index = CrossTUIndex(max_bytes=1)
+        index.parse_tu(self.test_file)
+        index.parse_tu(self.print_file)
+        self.assertEqual(list(index.tus), [self.print_file])
+        self.assertIn(self.test_file, index.evicted)
+
+    def test_pinned_not_evicted(self):
+        """Pinned translation units are never evicted."""
+        index = CrossTUIndex(max_tus=1, pinned=lambda: [self.test_file])
+        index.parse_tu(self.test_file)
+        index.parse_tu(self.print_file)
+        self.assertIn(self.test_file, index.tus)
+        self.assertIn(self.print_file, index.tus)
+        index.parse_tu(self.test_h_file)
+        self.assertEqual(set(index.tus), set([self.test_file,
+                                              self.test_h_file]))
@@ -0,0 +1,172 @@
+"""A read-only snapshot of symbol definitions in a flat, sorted file format.
+
+The snapshot is read through mmap and searched in place, so opening one is
+nearly free and only the pages touched by lookups are loaded, however many
+symbols it holds.
+
+The file is laid out as:
+
+  header    magic, version, number of USRs, number of locations, and the
+            offsets of the tables and string pool below.
+  USR table one (usr offset, usr length, location index) entry per USR,
+            sorted by USR.
+  locations one (file offset, file length, line, column, name offset, name
+            length) entry per definition.
+  strings   the bytes of every USR, filename and display name. Filenames and
+            names are only stored once.
+"""
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = 'CTFI'
+VERSION = 1
+
+HEADER = struct.Struct('<4sIIIIII')
+USR_ENTRY = struct.Struct('<III')
+LOCATION = struct.Struct('<IIIIII')
+
+
+class FlatIndexError(Exception):
+    """Represents an error reading a snapshot file."""
+    pass
+
+
+def write_snapshot(path, definitions):
+    """Write a snapshot of definitions to path.
+
+    definitions is an iterable of (usr, filename, line, column, name) tuples.
+    If a USR appears more than once, the first definition is kept.
+    """
+    strings = []
+    strings_size = [0]
+    interned = dict()
+
+    def add_string(value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        try:
+            return interned[value]
+        except KeyError:
+            span = (strings_size[0], len(value))
+            strings.append(value)
+            strings_size[0] += len(value)
+            interned[value] = span
+            return span
+
+    usrs = dict()
+    locations = []
+    for usr, filename, line, column, name in definitions:
+        if isinstance(usr, unicode):
+            usr = usr.encode('utf-8')
+        if usr in usrs:
+            continue
+        usrs[usr] = len(locations)
+        file_span = add_string(filename)
+        name_span = add_string(name)
+        locations.append((file_span[0], file_span[1], line, column,
+                          name_span[0], name_span[1]))
+
+    # USRs are stored separately from the interned strings so they are
+    # written in sorted order, which keeps lookups local.
+    sorted_usrs = sorted(usrs)
+    usr_table_offset = HEADER.size
+    locations_offset = usr_table_offset + USR_ENTRY.size * len(sorted_usrs)
+    usr_pool_offset = locations_offset + LOCATION.size * len(locations)
+    usr_pool_size = sum(len(usr) for usr in sorted_usrs)
+    strings_offset = usr_pool_offset + usr_pool_size
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(sorted_usrs), len(locations),
+                            locations_offset, usr_pool_offset,
+                            strings_offset))
+        usr_offset = usr_pool_offset
+        for usr in sorted_usrs:
+            f.write(USR_ENTRY.pack(usr_offset, len(usr), usrs[usr]))
+            usr_offset += len(usr)
+        for location in locations:
+            f.write(LOCATION.pack(location[0] + strings_offset, location[1],
+                                  location[2], location[3],
+                                  location[4] + strings_offset, location[5]))
+        for usr in sorted_usrs:
+            f.write(usr)
+        for value in strings:
+            f.write(value)
+    os.rename(tmp_path, path)
+
+
+class FlatIndex:
+    """A memory-mapped snapshot written by write_snapshot."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise FlatIndexError('{} is not a snapshot'.format(path))
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.count, self.location_count,
+         self.locations_offset, _, _) = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.data.close()
+            raise FlatIndexError('{} is not a snapshot'.format(path))
+
+    def close(self):
+        """Unmap the snapshot."""
+        self.data.close()
+
+    def __len__(self):
+        return self.count
+
+    def _usr(self, i):
+        offset, length, _ = USR_ENTRY.unpack_from(
+            self.data, HEADER.size + USR_ENTRY.size * i)
+        return self.data[offset:offset + length]
+
+    def find_definition(self, usr):
+        """Return the (usr, file, line, column, name) of a definition.
+
+        Return None if the USR is not in the snapshot.
+        """
+        if isinstance(usr, unicode):
+            usr = usr.encode('utf-8')
+
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._usr(mid) < usr:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self.count or self._usr(lo) != usr:
+            return None
+
+        _, _, location = USR_ENTRY.unpack_from(
+            self.data, HEADER.size + USR_ENTRY.size * lo)
+        (file_offset, file_length, line, column,
+         name_offset, name_length) = LOCATION.unpack_from(
+             self.data, self.locations_offset + LOCATION.size * location)
+        return (usr, self.data[file_offset:file_offset + file_length],
+                line, column, self.data[name_offset:name_offset + name_length])
+
+
+def main(argv):
+    """Write a snapshot of the definitions in a symbol store."""
+    from symbol_store import SymbolStore
+
+    if len(argv) != 3:
+        sys.stderr.write('usage: {} STORE SNAPSHOT\n'.format(argv[0]))
+        return 1
+
+    store = SymbolStore(argv[1])
+    write_snapshot(argv[2], store.definitions())
+    store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+from clang_tools import CrossTUIndex, SymbolRecord
+from flat_index import FlatIndex, write_snapshot
+import clang.cindex as ci
+
+
+class TestFlatIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'snapshot.idx')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_find_definition(self):
+        """Look up definitions by USR in a snapshot."""
+        write_snapshot(self.path, [
+            ('c:@F@b#', 'b.cpp', 3, 6, 'b()'),
+            ('c:@F@a#', 'a.cpp', 1, 6, 'a()'),
+            ('c:@F@c#', 'a.cpp', 9, 6, 'c()'),
+            ('c:@F@a#', 'other.cpp', 2, 6, 'a()'),
+        ])
+        snapshot = FlatIndex(self.path)
+        self.assertEqual(len(snapshot), 3)
+        self.assertEqual(snapshot.find_definition('c:@F@a#'),
+                         ('c:@F@a#', 'a.cpp', 1, 6, 'a()'))
+        self.assertEqual(snapshot.find_definition('c:@F@c#'),
+                         ('c:@F@c#', 'a.cpp', 9, 6, 'c()'))
+        self.assertIsNone(snapshot.find_definition('c:@F@d#'))
+        self.assertIsNone(snapshot.find_definition(''))
+        snapshot.close()
+
+    def test_find_definition_in_snapshot(self):
+        """Definitions of files not loaded are found in the snapshot."""
+        if not ci.Config.loaded:
+            ci.Config.set_library_path('clang/lib')
+        write_snapshot(self.path, [
+            ('c:@F@in_other_tu#', '/snapshot/print.cpp', 4, 6,
+             'in_other_tu()'),
+        ])
+        snapshot = FlatIndex(self.path)
+        index = CrossTUIndex(snapshot=snapshot)
+        test_file = 'test/find-defn/test.cpp'
+        index.parse_tu(test_file)
+        defn = index.find_definition(test_file, line=7, col=9)
+        self.assertIsInstance(defn, SymbolRecord)
+        self.assertEqual(defn.displayname, 'in_other_tu()')
+        self.assertEqual(defn.filename, '/snapshot/print.cpp')
+        self.assertEqual((defn.line, defn.column), (4, 6))
+        snapshot.close()
@@ -0,0 +1,68 @@
+"""A reverse index from included files to the translation units including them.
+
+The graph is updated whenever a translation unit is parsed, from the includes
+libclang reports for it. An edit to a header then only affects the translation
+units that actually include it, directly or not.
+"""
+import os.path
+
+
+class IncludeGraph:
+    """The files each translation unit includes, and the reverse."""
+
+    def __init__(self):
+        # The absolute paths of the files each translation unit includes.
+        self.includes = dict()
+        # The translation units including each file, keyed by absolute path.
+        self.includers = dict()
+        # Translation units keyed by the absolute path of their own file.
+        self.sources = dict()
+
+    def __contains__(self, tu):
+        return tu in self.includes
+
+    def update(self, tu, files):
+        """Replace the set of files a translation unit includes."""
+        self.remove(tu)
+        files = frozenset(os.path.abspath(f) for f in files)
+        self.includes[tu] = files
+        self.sources[os.path.abspath(tu)] = tu
+        for f in files:
+            self.includers.setdefault(f, set()).add(tu)
+
+    def remove(self, tu):
+        """Forget a translation unit."""
+        files = self.includes.pop(tu, None)
+        if files is None:
+            return
+        del self.sources[os.path.abspath(tu)]
+        for f in files:
+            includers = self.includers[f]
+            includers.discard(tu)
+            if not includers:
+                del self.includers[f]
+
+    def includes_of(self, tu):
+        """Return the absolute paths of the files a translation unit includes.
+
+        This is empty if the translation unit was never recorded.
+        """
+        return self.includes.get(tu, frozenset())
+
+    def including(self, filename):
+        """Return the translation units which include a file."""
+        return set(self.includers.get(os.path.abspath(filename), ()))
+
+    def affected(self, changed_files):
+        """Return the translation units affected by changes to some files.
+
+        A translation unit is affected if its own file or any file it includes
+        changed.
+        """
+        affected = set()
+        for f in changed_files:
+            f = os.path.abspath(f)
+            affected.update(self.includers.get(f, ()))
+            if f in self.sources:
+                affected.add(self.sources[f])
+        return affected
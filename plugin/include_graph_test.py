@@ -0,0 +1,38 @@
+import os.path
+import unittest
+from include_graph import IncludeGraph
+
+
+class TestIncludeGraph(unittest.TestCase):
+    def setUp(self):
+        self.graph = IncludeGraph()
+        self.graph.update('a.cpp', ['common.h', 'a.h'])
+        self.graph.update('b.cpp', ['common.h'])
+
+    def test_including(self):
+        self.assertEqual(self.graph.including('common.h'),
+                         set(['a.cpp', 'b.cpp']))
+        self.assertEqual(self.graph.including(os.path.abspath('a.h')),
+                         set(['a.cpp']))
+        self.assertEqual(self.graph.including('b.cpp'), set())
+
+    def test_includes_of(self):
+        self.assertEqual(self.graph.includes_of('b.cpp'),
+                         frozenset([os.path.abspath('common.h')]))
+        self.assertEqual(self.graph.includes_of('c.cpp'), frozenset())
+
+    def test_affected(self):
+        """Only a changed file's includers, or its own TU, are affected."""
+        self.assertEqual(self.graph.affected(['a.h']), set(['a.cpp']))
+        self.assertEqual(self.graph.affected(['common.h']),
+                         set(['a.cpp', 'b.cpp']))
+        self.assertEqual(self.graph.affected([os.path.abspath('b.cpp')]),
+                         set(['b.cpp']))
+        self.assertEqual(self.graph.affected(['other.h']), set())
+
+    def test_update_replaces_includes(self):
+        self.graph.update('a.cpp', ['a.h'])
+        self.assertEqual(self.graph.including('common.h'), set(['b.cpp']))
+        self.graph.remove('b.cpp')
+        self.assertEqual(self.graph.including('common.h'), set())
+        self.assertNotIn('common.h', self.graph.includers)
@@ -0,0 +1,139 @@
+"""A bounded pool of threads to parse and reparse translation units on.
+
+ctypes releases the GIL while libclang runs, so translation units parsed on
+several threads are parsed in parallel. Each worker creates its translation
+units with its own Index. A translation unit must still only be used by one
+thread at a time, so callers must wait for a job to finish before touching
+the translation unit it works on.
+
+Jobs are run in order of priority, and jobs which haven't started yet can be
+cancelled.
+"""
+import Queue
+import itertools
+import multiprocessing
+import threading
+import time
+import clang.cindex as ci
+
+
+class JobCancelled(Exception):
+    """Represents a job that was cancelled before it ran."""
+    pass
+
+
+class ParseJob:
+    """A function to run on the pool, and its result once it has run."""
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.result = None
+        self.error = None
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+        self.started = False
+        self.cancelled = False
+
+    def run(self, index):
+        """Run the function with a worker's Index as its first argument."""
+        with self.lock:
+            if self.cancelled:
+                return
+            self.started = True
+        try:
+            self.result = self.function(index, *self.args)
+        except Exception, e:
+            self.error = e
+        finally:
+            self.finished.set()
+
+    def cancel(self):
+        """Cancel the job if it hasn't started, and return whether it was."""
+        with self.lock:
+            if self.started:
+                return False
+            if not self.cancelled:
+                self.cancelled = True
+                self.error = JobCancelled()
+                self.finished.set()
+            return True
+
+    def done(self):
+        """Return whether the job has finished."""
+        return self.finished.is_set()
+
+    def wait(self, timeout=None):
+        """Wait for the job to finish, and return whether it did."""
+        return self.finished.wait(timeout)
+
+    def get(self):
+        """Return the result of a finished job, or raise its exception."""
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class ParsePool:
+    """Worker threads running ParseJobs, each with its own Index."""
+
+    def __init__(self, workers=0):
+        if workers <= 0:
+            workers = multiprocessing.cpu_count()
+        # Queued (priority, sequence number, job), lowest first.
+        self.jobs = Queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.threads = []
+        for _ in xrange(workers):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def __len__(self):
+        return len(self.threads)
+
+    def work(self):
+        index = ci.Index.create()
+        while True:
+            _, _, job = self.jobs.get()
+            if job is None:
+                return
+            job.run(index)
+
+    def submit(self, function, *args, **kwargs):
+        """Queue function(index, *args) to run on a worker.
+
+        Jobs with a lower priority keyword argument run first, and jobs with
+        the same priority run in the order they were submitted. Return the
+        ParseJob to wait on.
+        """
+        job = ParseJob(function, args)
+        self.jobs.put((kwargs.get('priority', 0), next(self.sequence), job))
+        return job
+
+    def close(self):
+        """Stop the workers once they've run every queued job."""
+        for _ in self.threads:
+            self.jobs.put((float('inf'), next(self.sequence), None))
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+def wait_for_any(jobs, deadline=None):
+    """Wait until one of the jobs finishes, or until the deadline passes.
+
+    deadline is a time.time() value, or None to wait as long as it takes.
+    Return the finished jobs, which is empty if the deadline passed first.
+    """
+    while True:
+        finished = [job for job in jobs if job.done()]
+        if finished or not jobs:
+            return finished
+        timeout = 0.01
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+            if timeout <= 0:
+                return []
+        jobs[0].wait(timeout)
@@ -0,0 +1,74 @@
+import threading
+import unittest
+from clang_tools import CrossTUIndex
+from parse_pool import JobCancelled, ParsePool
+import clang.cindex as ci
+
+
+class TestParsePool(unittest.TestCase):
+    def setUp(self):
+        if not ci.Config.loaded:
+            ci.Config.set_library_path('clang/lib')
+        self.pool = ParsePool(1)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_priority(self):
+        """Queued jobs with a lower priority run first."""
+        release = threading.Event()
+        order = []
+        self.pool.submit(lambda index: release.wait())
+        jobs = [self.pool.submit(lambda index, n: order.append(n), n,
+                                 priority=priority)
+                for n, priority in [(1, 1), (2, 0), (3, 1)]]
+        release.set()
+        for job in jobs:
+            job.wait()
+        self.assertEqual(order, [2, 1, 3])
+
+    def test_cancel(self):
+        """Jobs can be cancelled until they start."""
+        release = threading.Event()
+        started = threading.Event()
+        running = self.pool.submit(
+            lambda index: (started.set(), release.wait()))
+        queued = self.pool.submit(lambda index: 'ran')
+        started.wait()
+        self.assertFalse(running.cancel())
+        self.assertTrue(queued.cancel())
+        self.assertTrue(queued.done())
+        self.assertRaises(JobCancelled, queued.get)
+        release.set()
+        running.wait()
+        self.assertIsNone(queued.result)
+
+
+class TestParallelParsing(unittest.TestCase):
+    def setUp(self):
+        if not ci.Config.loaded:
+            ci.Config.set_library_path('clang/lib')
+        self.pool = ParsePool(2)
+        self.index = CrossTUIndex(pool=self.pool)
+        self.test_file = 'test/find-defn/test.cpp'
+        self.print_file = 'test/find-defn/print.cpp'
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_parse_in_parallel(self):
+        loaded = self.index.parse_tus([self.test_file, self.print_file])
+        self.assertEqual(set(loaded), set([self.test_file, self.print_file]))
+        reparsed = self.index.reparse_tus([self.test_file, self.print_file])
+        self.assertEqual(set(reparsed), set(loaded))
+        defn = self.index.find_definition(self.test_file, line=7, col=9)
+        self.assertEqual(defn.displayname, 'in_other_tu()')
+
+    def test_unfinished_jobs_applied_when_needed(self):
+        """Jobs not finished by the deadline are applied on first use."""
+        self.index.parse_tus([self.test_file, self.print_file], timeout=0)
+        defn = self.index.find_definition(self.test_file, line=7, col=9)
+        self.assertIsNotNone(defn)
+        self.index.finish_jobs()
+        self.assertEqual(self.index.jobs, {})
+        self.assertEqual(len(self.index.tus), 2)
@@ -0,0 +1,206 @@
+"""Index every file in a compilation database into a symbol store.
+
+Files are parsed with the arguments from compile_commands.json on a pool of
+worker processes. Each worker sends back the compact symbol tuples from
+clang_tools.collect_symbols, and the parent process writes them to the store
+as they arrive. Files whose contents and arguments haven't changed since they
+were last indexed are skipped. The symbols in a header are stored under the
+header, once, rather than under every file that includes it.
+
+This runs without an editor, for example:
+
+  python project_indexer.py -j 8 build/ symbols.db
+"""
+import argparse
+import multiprocessing
+import sys
+import time
+import clang.cindex as ci
+import clang_tools
+import symbol_store
+from compile_flags import arguments_for_command, command_filename
+
+# The Index used by each worker process, and the headers whose symbols it
+# has already sent back.
+worker_index = None
+worker_headers = set()
+
+# The longest to wait for a file's symbols, in seconds. A worker which
+# crashes in libclang never returns its result, so without a limit the
+# indexer would wait for it forever.
+FILE_TIMEOUT = 600
+
+
+def init_worker(library_path):
+    """Load libclang in a worker process."""
+    global worker_index
+    if library_path != '' and not ci.Config.loaded:
+        ci.Config.set_library_path(library_path)
+    worker_index = ci.Index.create()
+
+
+def index_file(job):
+    """Parse one file and collect its symbols.
+
+    Return (filename, content hash, args, symbols, headers), where symbols
+    are those in the file itself, and headers is a dict of the symbols in
+    each header it includes that this worker hasn't sent before. symbols and
+    headers are None if the file couldn't be parsed.
+    """
+    filename, content_hash, args = job
+    try:
+        tu = worker_index.parse(filename, list(args))
+    except ci.TranslationUnitLoadError:
+        return filename, content_hash, args, None, None
+    headers = clang_tools.symbols_by_file(
+        clang_tools.collect_symbols(tu.cursor))
+    symbols = headers.pop(filename, [])
+    for header in headers.keys():
+        if header in worker_headers:
+            del headers[header]
+    worker_headers.update(headers)
+    return filename, content_hash, args, symbols, headers
+
+
+def store_headers(store, headers, written):
+    """Write the symbols of headers not yet written by this run.
+
+    A header's rows are only replaced if its contents changed since they
+    were stored. written is the set of headers already handled.
+    """
+    for header, symbols in headers.iteritems():
+        if header in written:
+            continue
+        written.add(header)
+        try:
+            content_hash = symbol_store.file_hash(header)
+        except IOError:
+            continue
+        if not store.is_current(header, content_hash):
+            store.replace_file(header, content_hash, None, symbols)
+
+
+def compile_jobs(cdb):
+    """Return a (filename, args) pair per file in the compilation database.
+
+    If a file is compiled more than once, the first command is used.
+    """
+    jobs = []
+    seen = set()
+    commands = cdb.getAllCompileCommands()
+    if commands is None:
+        return jobs
+    for cmd in commands:
+        filename = command_filename(cmd)
+        if filename in seen:
+            continue
+        seen.add(filename)
+        jobs.append((filename, arguments_for_command(cmd)))
+    return jobs
+
+
+def index_project(build_dir, store, processes=None, library_path='',
+                  progress=None, timeout=FILE_TIMEOUT):
+    """Index every file in the compilation database in build_dir.
+
+    processes is the number of worker processes, defaulting to the number of
+    CPUs. If progress is given, it is called with (files done, total files,
+    elapsed seconds) after each file. A file whose symbols haven't arrived
+    timeout seconds after the previous file's did counts as failed.
+
+    Return a tuple of (files indexed, files that failed, elapsed seconds).
+    """
+    if library_path != '' and not ci.Config.loaded:
+        ci.Config.set_library_path(library_path)
+    cdb = ci.CompilationDatabase.fromDirectory(build_dir)
+
+    jobs = []
+    for filename, args in compile_jobs(cdb):
+        try:
+            content_hash = symbol_store.file_hash(filename)
+        except IOError:
+            clang_tools.print_warning('Cannot read {}'.format(filename))
+            continue
+        if not store.is_current(filename, content_hash, args):
+            jobs.append((filename, content_hash, args))
+
+    start = time.time()
+    done = 0
+    failed = 0
+    timed_out = False
+    written = set()
+    pool = multiprocessing.Pool(processes, init_worker, (library_path,))
+    try:
+        results = [pool.apply_async(index_file, (job,)) for job in jobs]
+        for (filename, content_hash, args), result in zip(jobs, results):
+            try:
+                _, _, _, symbols, headers = result.get(timeout)
+            except multiprocessing.TimeoutError:
+                clang_tools.print_warning(
+                    'Timed out indexing {}'.format(filename))
+                timed_out = True
+                symbols = None
+            except Exception, e:
+                clang_tools.print_warning(
+                    'Failed to index {}: {}'.format(filename, e))
+                symbols = None
+            if symbols is None:
+                failed += 1
+            else:
+                store.replace_file(filename, content_hash, args, symbols)
+                store_headers(store, headers, written)
+            done += 1
+            if progress is not None:
+                progress(done, len(jobs), time.time() - start)
+    finally:
+        if timed_out:
+            # A stuck worker would never finish, so don't wait for it.
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
+    return done - failed, failed, time.time() - start
+
+
+def print_progress(done, total, elapsed):
+    """Report progress and throughput on stderr."""
+    rate = done / elapsed if elapsed > 0 else 0.0
+    sys.stderr.write('\r{}/{} files, {:.1f} files/sec'.format(done, total,
+                                                              rate))
+    if done == total:
+        sys.stderr.write('\n')
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Index a project from its compilation database.')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes')
+    parser.add_argument('--library-path', default='',
+                        help='directory containing libclang')
+    parser.add_argument('--timeout', type=float, default=FILE_TIMEOUT,
+                        help='seconds to wait for each file')
+    parser.add_argument('build_dir',
+                        help='directory containing compile_commands.json')
+    parser.add_argument('store', help='symbol database to write')
+    options = parser.parse_args(argv[1:])
+
+    store = symbol_store.SymbolStore(options.store)
+    try:
+        indexed, failed, elapsed = index_project(options.build_dir, store,
+                                                 options.jobs,
+                                                 options.library_path,
+                                                 print_progress,
+                                                 options.timeout)
+    finally:
+        store.close()
+
+    rate = indexed / elapsed if elapsed > 0 else 0.0
+    print('Indexed {} files ({} failed) in {:.1f}s, {:.1f} files/sec'.format(
+        indexed, failed, elapsed, rate))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import project_indexer
+from project_indexer import compile_jobs, index_project
+import symbol_store
+from symbol_store import SymbolStore
+import clang.cindex as ci
+
+
+def crashing_index_file(job):
+    """Stand in for index_file in a worker that dies."""
+    os._exit(1)
+
+
+class TestProjectIndexer(unittest.TestCase):
+    def setUp(self):
+        if not ci.Config.loaded:
+            ci.Config.set_library_path('clang/lib')
+        self.tmpdir = tempfile.mkdtemp()
+        self.source_dir = os.path.abspath('test/find-defn')
+        commands = []
+        for source in ['test.cpp', 'print.cpp', 'test.cpp']:
+            commands.append({
+                'directory': self.source_dir,
+                'command': 'c++ -c {} -o out.o'.format(source),
+                'file': source,
+            })
+        with open(os.path.join(self.tmpdir, 'compile_commands.json'),
+                  'w') as f:
+            json.dump(commands, f)
+        self.store = SymbolStore(os.path.join(self.tmpdir, 'symbols.db'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_compile_jobs(self):
+        """Each file is indexed once, with the arguments of its first entry."""
+        cdb = ci.CompilationDatabase.fromDirectory(self.tmpdir)
+        jobs = compile_jobs(cdb)
+        self.assertEqual([filename for filename, _ in jobs],
+                         [os.path.join(self.source_dir, 'test.cpp'),
+                          os.path.join(self.source_dir, 'print.cpp')])
+        self.assertNotIn('-c', jobs[0][1])
+        self.assertNotIn('out.o', jobs[0][1])
+
+    def test_index_project(self):
+        indexed, failed, _ = index_project(self.tmpdir, self.store, 1)
+        self.assertEqual((indexed, failed), (2, 0))
+        defn = self.store.find_definition('c:@F@in_other_tu#')
+        self.assertEqual(defn[1], os.path.join(self.source_dir, 'print.cpp'))
+        # Both files include test.h, whose symbols are stored once under it.
+        header = os.path.join(self.source_dir, 'test.h')
+        self.assertEqual(self.store.db.execute(
+            'SELECT source FROM symbols WHERE usr = ? AND role = ?',
+            ('c:@F@inline_header#', symbol_store.DEFINITION)).fetchall(),
+            [(header,)])
+
+        # Nothing changed, so nothing is indexed again.
+        indexed, failed, _ = index_project(self.tmpdir, self.store, 1)
+        self.assertEqual((indexed, failed), (0, 0))
+
+    def test_worker_crash(self):
+        """Files whose worker died count as failed instead of hanging."""
+        index_file = project_indexer.index_file
+        project_indexer.index_file = crashing_index_file
+        try:
+            indexed, failed, _ = index_project(self.tmpdir, self.store, 1,
+                                               timeout=1)
+        finally:
+            project_indexer.index_file = index_file
+        self.assertEqual((indexed, failed), (0, 2))
@@ -0,0 +1,59 @@
+"""Debounce changes to files, and reparse what they affect in the background.
+
+The editor reports files as they change. Once a file has been left alone for
+a short delay, the translation units it affects are handed to the index's
+ParsePool, with the file being edited first. The scheduler never waits for
+them: each call applies whichever jobs have finished, so the editor can poll
+it from a timer and find a fresh AST waiting when it needs one.
+"""
+import os.path
+import time
+
+
+class ReparseScheduler:
+    """Reparse translation units once the files they include stop changing."""
+
+    def __init__(self, index, delay=0.3):
+        self.index = index
+        self.delay = delay
+        # When each changed file is due to be reparsed.
+        self.due = dict()
+
+    def file_changed(self, filename, now=None):
+        """Record that a file changed, postponing its reparse."""
+        if now is None:
+            now = time.time()
+        self.due[os.path.abspath(filename)] = now + self.delay
+
+    def flush(self):
+        """Make every changed file due to be reparsed straight away."""
+        for filename in self.due:
+            self.due[filename] = 0
+
+    def due_files(self, now=None):
+        """Remove and return the changed files which are due."""
+        if now is None:
+            now = time.time()
+        due = [f for f, when in self.due.iteritems() if when <= now]
+        for filename in due:
+            del self.due[filename]
+        return due
+
+    def pending(self):
+        """Return whether there are changes or jobs left to handle."""
+        return bool(self.due or self.index.jobs)
+
+    def run(self, unsaved_files, now=None):
+        """Start reparsing for the due files, and apply any finished jobs.
+
+        A translation unit whose files changed again while it was being
+        reparsed has its result discarded, and is reparsed again. Return
+        whether there's more to do.
+        """
+        due = self.due_files(now)
+        if due:
+            self.index.reparse_tus(self.index.invalidate(due), unsaved_files,
+                                   timeout=0)
+        else:
+            self.index.finish_jobs(timeout=0)
+        return self.pending()
@@ -0,0 +1,82 @@
+import os.path
+import time
+import unittest
+from clang_tools import CrossTUIndex
+from parse_pool import ParsePool
+from reparse_scheduler import ReparseScheduler
+import clang.cindex as ci
+
+
+class TestReparseScheduler(unittest.TestCase):
+    def setUp(self):
+        if not ci.Config.loaded:
+            ci.Config.set_library_path('clang/lib')
+        self.pool = ParsePool(2)
+        self.index = CrossTUIndex(pool=self.pool)
+        self.test_file = 'test/find-defn/test.cpp'
+        self.print_file = 'test/find-defn/print.cpp'
+        self.test_h_file = os.path.abspath('test/find-defn/test.h')
+        self.index.parse_tus([self.test_file, self.print_file])
+        self.scheduler = ReparseScheduler(self.index, delay=1)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_debounce(self):
+        """Files are only reparsed once they stop changing."""
+        self.scheduler.file_changed(self.test_h_file, now=0)
+        self.assertTrue(self.scheduler.run([], now=0.5))
+        self.assertEqual(self.index.jobs, {})
+        self.scheduler.file_changed(self.test_h_file, now=0.5)
+        self.scheduler.run([], now=1.2)
+        self.assertEqual(self.index.jobs, {})
+
+        self.scheduler.run([], now=1.5)
+        self.assertEqual(set(self.index.jobs),
+                         set([self.test_file, self.print_file]))
+        self.index.finish_jobs()
+        self.assertFalse(self.scheduler.run([], now=1.5))
+
+    def test_changed_again_while_reparsing(self):
+        """A translation unit changed during its reparse is reparsed again."""
+        self.index.reparse_tus([self.test_file], timeout=0)
+        contents = 'void changed_again();\n'
+        self.index.reparse_tus([self.test_file], [(self.test_file, contents)],
+                               timeout=0)
+        self.index.finish_jobs()
+        self.assertEqual(self.index.requeued, {})
+        tu = self.index.tus[self.test_file]
+        self.assertEqual([c.spelling for c in tu.cursor.get_children()
+                          if c.location.file and
+                          c.location.file.name == self.test_file],
+                         ['changed_again'])
+
+    def test_memory_usage_skips_jobs(self):
+        """Translation units being reparsed aren't measured."""
+        self.index.reparse_tus([self.test_file], timeout=0)
+        self.assertIn(self.test_file, self.index.jobs)
+        self.assertEqual(set(self.index.memory_usage()),
+                         set(self.index.tus) - set([self.test_file]))
+        self.index.finish_jobs()
+        self.assertIn(self.test_file, self.index.memory_usage())
+
+    def test_requeued_reparse_finishes(self):
+        """A reparse already running is finished, then reparsed again."""
+        self.index.reparse_tus([self.test_file], timeout=0)
+        job = self.index.jobs[self.test_file][0]
+        while not job.started and not job.done():
+            time.sleep(0.001)
+        contents = 'void changed_while_running() {}\n'
+        self.index.reparse_tus([self.test_file], [(self.test_file, contents)],
+                               timeout=0)
+        self.assertIn(self.test_file, self.index.requeued)
+
+        self.assertEqual(self.index.finish_jobs(), [self.test_file])
+        self.assertEqual(self.index.requeued, {})
+        self.assertEqual(self.index.jobs, {})
+        tu = self.index.tus[self.test_file]
+        self.assertEqual([c.spelling for c in tu.cursor.get_children()
+                          if c.location.file and
+                          c.location.file.name == self.test_file],
+                         ['changed_while_running'])
+        self.assertIn('c:@F@changed_while_running#', self.index.definitions)
@@ -0,0 +1,143 @@
+"""A persistent store of symbols, kept in an sqlite database.
+
+The store records the definitions, declarations and references found in each
+parsed source file, so that cross translation unit navigation works without
+first parsing every file again in a new session. The rows for a file are only
+replaced when its contents or compile arguments change.
+"""
+import hashlib
+import sqlite3
+
+# Roles a symbol can appear in.
+DEFINITION = 0
+DECLARATION = 1
+REFERENCE = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    args TEXT NOT NULL,
+    skipped_bodies INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS symbols (
+    usr TEXT NOT NULL,
+    role INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    file TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    col INTEGER NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS symbols_usr ON symbols (usr, role);
+CREATE INDEX IF NOT EXISTS symbols_source ON symbols (source);
+"""
+
+
+def content_hash(contents):
+    """Return a hash of the contents of a file."""
+    return hashlib.sha1(contents).hexdigest()
+
+
+def file_hash(filename):
+    """Return a hash of the contents of a file on disk."""
+    with open(filename, 'rb') as f:
+        return content_hash(f.read())
+
+
+def args_key(args):
+    """Return the compile arguments as a single string for storage."""
+    if not args:
+        return ''
+    return '\0'.join(args)
+
+
+class SymbolStore:
+    """Symbols for each source file, keyed by USR."""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        columns = [row[1] for row in
+                   self.db.execute('PRAGMA table_info(files)')]
+        if 'skipped_bodies' not in columns:
+            # Written before the column was added.
+            with self.db:
+                self.db.execute('ALTER TABLE files ADD COLUMN skipped_bodies '
+                                'INTEGER NOT NULL DEFAULT 0')
+
+    def close(self):
+        """Close the underlying database."""
+        self.db.close()
+
+    def is_current(self, source, content_hash, args=None,
+                   skipped_bodies=False):
+        """Return whether the rows for a source file are up to date.
+
+        Rows from a parse without function bodies lack the references inside
+        them, so they're only current if skipped_bodies is also set.
+        """
+        row = self.db.execute(
+            'SELECT hash, args, skipped_bodies FROM files WHERE path = ?',
+            (source,)).fetchone()
+        if row is None:
+            return False
+        return (row[0] == content_hash and row[1] == args_key(args) and
+                (skipped_bodies or not row[2]))
+
+    def replace_file(self, source, content_hash, args, symbols,
+                     skipped_bodies=False):
+        """Replace all rows recorded for a source file.
+
+        symbols is an iterable of (usr, role, file, line, column, name)
+        tuples. skipped_bodies is whether they were found in a parse without
+        function bodies.
+        """
+        with self.db:
+            self.db.execute('DELETE FROM symbols WHERE source = ?', (source,))
+            self.db.executemany(
+                'INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((usr, role, source, f, line, col, name)
+                 for usr, role, f, line, col, name in symbols))
+            self.db.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                (source, content_hash, args_key(args), int(skipped_bodies)))
+
+    def invalidate(self, source):
+        """Mark the rows for a source file as out of date.
+
+        They can still be found, but is_current is false for the file until
+        its rows are replaced.
+        """
+        with self.db:
+            self.db.execute("UPDATE files SET hash = '' WHERE path = ?",
+                            (source,))
+
+    def remove_file(self, source):
+        """Remove all rows recorded for a source file."""
+        with self.db:
+            self.db.execute('DELETE FROM symbols WHERE source = ?', (source,))
+            self.db.execute('DELETE FROM files WHERE path = ?', (source,))
+
+    def find(self, usr, role):
+        """Return the (usr, file, line, column, name) of each occurrence."""
+        return self.db.execute(
+            'SELECT DISTINCT usr, file, line, col, name FROM symbols '
+            'WHERE usr = ? AND role = ?', (usr, role)).fetchall()
+
+    def find_definition(self, usr):
+        """Return the (usr, file, line, column, name) of a definition.
+
+        Return None if no definition is known.
+        """
+        return self.db.execute(
+            'SELECT usr, file, line, col, name FROM symbols '
+            'WHERE usr = ? AND role = ? LIMIT 1',
+            (usr, DEFINITION)).fetchone()
+
+    def definitions(self):
+        """Iterate over the (usr, file, line, column, name) of definitions."""
+        return self.db.execute(
+            'SELECT usr, file, line, col, name FROM symbols WHERE role = ?',
+            (DEFINITION,))
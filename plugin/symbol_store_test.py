@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+from clang_tools import CrossTUIndex, SymbolRecord
+import symbol_store
+from symbol_store import SymbolStore, file_hash
+import clang.cindex as ci
+
+
+class TestSymbolStore(unittest.TestCase):
+    def setUp(self):
+        if not ci.Config.loaded:
+            ci.Config.set_library_path('clang/lib')
+        self.tmpdir = tempfile.mkdtemp()
+        self.store_path = os.path.join(self.tmpdir, 'symbols.db')
+        self.test_file = 'test/find-defn/test.cpp'
+        self.print_file = 'test/find-defn/print.cpp'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_definition_from_previous_session(self):
+        """Find a definition in a file only parsed in an earlier session."""
+        store = SymbolStore(self.store_path)
+        CrossTUIndex(store).parse_tu(self.print_file)
+        store.close()
+
+        index = CrossTUIndex(SymbolStore(self.store_path))
+        index.parse_tu(self.test_file)
+        defn = index.find_definition(self.test_file, line=7, col=9)
+        self.assertIsInstance(defn, SymbolRecord)
+        self.assertEqual(defn.displayname, 'in_other_tu()')
+        self.assertEqual(defn.filename, self.print_file)
+        self.assertEqual((defn.line, defn.column), (4, 6))
+
+    def test_header_symbols_stored_under_header(self):
+        """Each file's symbols are stored once, under that file."""
+        store = SymbolStore(self.store_path)
+        index = CrossTUIndex(store)
+        index.parse_tu(self.print_file)
+        index.parse_tu(self.test_file)
+        sources = dict(store.db.execute(
+            'SELECT source, COUNT(DISTINCT file) FROM symbols '
+            'GROUP BY source'))
+        self.assertEqual(sources[self.print_file], 1)
+        self.assertEqual(sources[self.test_file], 1)
+        header = os.path.abspath('test/find-defn/test.h')
+        self.assertEqual(sources[header], 1)
+        self.assertEqual(store.db.execute(
+            'SELECT COUNT(*) FROM symbols WHERE usr = ? AND role = ?',
+            ('c:@F@inline_header#', symbol_store.DEFINITION)).fetchone(),
+            (1,))
+        self.assertTrue(store.is_current(header, file_hash(header),
+                                         skipped_bodies=True))
+
+    def test_unchanged_file_is_current(self):
+        """Rows are kept for a file whose contents have not changed."""
+        store = SymbolStore(self.store_path)
+        index = CrossTUIndex(store)
+        index.set_active(self.print_file)
+        index.parse_tu(self.print_file)
+        self.assertTrue(store.is_current(self.print_file,
+                                         file_hash(self.print_file)))
+        self.assertFalse(store.is_current(self.print_file,
+                                          file_hash(self.print_file),
+                                          ['-DCHANGED']))
+
+    def test_skipped_bodies_not_current_for_full_parse(self):
+        """Rows without function bodies don't stand in for a full parse."""
+        store = SymbolStore(self.store_path)
+        index = CrossTUIndex(store)
+        index.parse_tu(self.print_file)
+        content_hash = file_hash(self.print_file)
+        self.assertTrue(store.is_current(self.print_file, content_hash,
+                                         skipped_bodies=True))
+        self.assertFalse(store.is_current(self.print_file, content_hash))
+
+        index.set_active(self.print_file)
+        self.assertTrue(store.is_current(self.print_file, content_hash))
+        self.assertTrue(store.is_current(self.print_file, content_hash,
+                                         skipped_bodies=True))
+
+    def test_header_change_invalidates_includers(self):
+        """Rows for files including a changed header are out of date."""
+        store = SymbolStore(self.store_path)
+        index = CrossTUIndex(store)
+        index.set_active(self.print_file)
+        index.parse_tu(self.print_file)
+        index.evict_tu(self.print_file)
+        index.invalidate([os.path.abspath('test/find-defn/test.h')])
+        self.assertFalse(store.is_current(self.print_file,
+                                          file_hash(self.print_file)))
+        # The rows can still be used until they are replaced.
+        self.assertIsNotNone(store.find_definition('c:@F@in_other_tu#'))
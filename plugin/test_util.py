@@ -0,0 +1,12 @@
+"""Helpers shared by the tests."""
+
+
+def node(cursor):
+    """Identify the AST node of a cursor.
+
+    Cursors for the same statement reached by different walks can hold
+    different parent declarations, and then don't compare equal. The kind is
+    given by id, as not every kind is known to the bindings.
+    """
+    extent = cursor.extent
+    return cursor._kind_id, extent.start.offset, extent.end.offset
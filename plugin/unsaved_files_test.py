@@ -0,0 +1,56 @@
+import mmap
+import unittest
+import clang.cindex as ci
+
+
+class TestUnsavedFiles(unittest.TestCase):
+    def setUp(self):
+        if not ci.Config.loaded:
+            ci.Config.set_library_path('clang/lib')
+        self.test_file = 'test/find-defn/test.cpp'
+
+    def spellings(self, tu):
+        return [c.spelling for c in tu.cursor.get_children()
+                if c.location.file and c.location.file.name == self.test_file]
+
+    def test_update_in_place(self):
+        """Changing the contents of a file reuses the same array."""
+        unsaved_files = ci.UnsavedFiles([('a.cpp', 'int a;'),
+                                         ('b.h', bytearray('int b;'))])
+        array = unsaved_files.from_param()
+        self.assertEqual(array[1].contents, 'int b;')
+        unsaved_files.set('a.cpp', memoryview('int aa;'))
+        self.assertIs(unsaved_files.from_param(), array)
+        self.assertEqual(array[0].contents, 'int aa;')
+        self.assertEqual(array[0].length, 7)
+        unsaved_files.update([('b.h', 'int c;')])
+        self.assertEqual(len(unsaved_files), 1)
+        self.assertEqual(unsaved_files.from_param()[0].name, 'b.h')
+
+    def test_buffer_changed_in_place(self):
+        """A mutable buffer is read again after it changes in place."""
+        contents = bytearray('int b;')
+        unsaved_files = ci.UnsavedFiles([('b.h', contents)])
+        array = unsaved_files.from_param()
+        contents.extend(' int c;' * 1000)
+        unsaved_files.set('b.h', contents)
+        self.assertEqual(array[0].length, len(contents))
+        contents[:] = 'int d;'
+        self.assertIs(unsaved_files.from_param(), array)
+        self.assertEqual(array[0].length, 6)
+        self.assertEqual(array[0].contents, 'int d;')
+
+    def test_reparse_with_buffers(self):
+        """Translation units can be reparsed from buffers."""
+        tu = ci.TranslationUnit.from_source(
+            self.test_file,
+            unsaved_files=[(self.test_file, bytearray('int from_bytes;'))])
+        self.assertEqual(self.spellings(tu), ['from_bytes'])
+
+        array = tu.unsaved_files.from_param()
+        with open(self.test_file, 'rb') as f:
+            contents = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        tu.reparse([(self.test_file, contents)])
+        self.assertIn('in_this_tu', self.spellings(tu))
+        self.assertIs(tu.unsaved_files.from_param(), array)
+        contents.close()
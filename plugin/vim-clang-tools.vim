@@ -1,4 +1,7 @@
 au FileType c,cpp,objc,objcpp call <SID>ClangToolsInit()
+au BufEnter * if index(['c', 'cpp', 'objc', 'objcpp'], &filetype) >= 0 | call <SID>ClangToolsBufEnter() | endif
+au BufUnload * call <SID>ClangToolsBufUnload(str2nr(expand('<abuf>')))
+au TextChanged,InsertLeave,BufWritePost * if index(['c', 'cpp', 'objc', 'objcpp'], &filetype) >= 0 | call <SID>ClangToolsBufChanged() | endif
 
 " Store the plugin path, as this is only available when sourcing the file.
 let s:plugin_path = escape(expand('<sfile>:p:h'), '\')
@@ -13,7 +16,69 @@ function! s:ClangToolsInit()
     let g:clangtools_library_path = ''
   endif
 
-  call s:initClangToolsPython()
+  if !exists('g:clangtools_index_path')
+    let g:clangtools_index_path = ''
+  endif
+
+  if !exists('g:clangtools_snapshot_path')
+    let g:clangtools_snapshot_path = ''
+  endif
+
+  if !exists('g:clangtools_build_dir')
+    let g:clangtools_build_dir = ''
+  endif
+
+  if !exists('g:clangtools_ast_cache_dir')
+    let g:clangtools_ast_cache_dir = ''
+  endif
+
+  if !exists('g:clangtools_max_tus')
+    let g:clangtools_max_tus = 0
+  endif
+
+  if !exists('g:clangtools_max_memory_mb')
+    let g:clangtools_max_memory_mb = 0
+  endif
+
+  if !exists('g:clangtools_parse_threads')
+    let g:clangtools_parse_threads = 0
+  endif
+
+  if !exists('g:clangtools_parse_timeout_ms')
+    let g:clangtools_parse_timeout_ms = 0
+  endif
+
+  if !exists('g:clangtools_reparse_delay_ms')
+    let g:clangtools_reparse_delay_ms = 300
+  endif
+
+  if !exists('g:clangtools_use_server')
+    let g:clangtools_use_server = 0
+  endif
+
+  if !exists('g:clangtools_server_socket')
+    let g:clangtools_server_socket = ''
+  endif
+
+  if !exists('g:clangtools_share_server')
+    let g:clangtools_share_server = 0
+  endif
+
+  if !exists('g:clangtools_project_root')
+    let g:clangtools_project_root = ''
+  endif
+
+  if !exists('g:clangtools_python')
+    let g:clangtools_python = 'python'
+  endif
+
+  if g:clangtools_use_server
+    if s:StartServer()
+      call s:ServerOpen()
+    endif
+  else
+    call s:initClangToolsPython()
+  endif
 endfunction
 
 function! s:initClangToolsPython()
@@ -27,10 +92,306 @@ function! s:initClangToolsPython()
       echoe 'clang_tools: Error loading the Python script.'
       return 0
     endif
+    let s:python_loaded = 1
+  endif
+  return 1
+endfunction
+
+function! s:ClangToolsBufEnter()
+  if s:ServerRunning()
+    call s:ServerOpen()
+    return
+  endif
+  if !exists('s:python_loaded')
+    return
+  endif
+  py activate_buffer(vim.eval("expand('%:p')"))
+endfunction
+
+function! s:ClangToolsBufChanged()
+  if s:ServerRunning()
+    " Only tell the server once the buffer stops changing.
+    call timer_stop(s:change_timer)
+    let s:change_timer = timer_start(g:clangtools_reparse_delay_ms,
+          \ function('s:OnChangeTimer'))
+    return
+  endif
+  let s:buffers_changed = 1
+  if exists('s:python_loaded') && s:reparse_timer == -1
+    " Poll the scheduler until it's reparsed everything affected.
+    let s:reparse_timer = timer_start(50, function('s:OnReparseTimer'),
+          \ {'repeat': -1})
+  endif
+endfunction
+
+let s:change_timer = -1
+let s:reparse_timer = -1
+" Whether a buffer changed since the reparse timer last looked at them.
+let s:buffers_changed = 0
+
+function! s:OnChangeTimer(timer)
+  call s:ServerChange()
+endfunction
+
+function! s:OnReparseTimer(timer)
+  " The buffers are only scanned again when one of them changed.
+  let l:scan = s:buffers_changed
+  let s:buffers_changed = 0
+  py vim.command('let l:pending = ' + str(schedule_reparse(int(vim.eval('l:scan')))))
+  if !l:pending
+    call timer_stop(s:reparse_timer)
+    let s:reparse_timer = -1
+  endif
+endfunction
+
+function! s:ClangToolsBufUnload(buffer)
+  if s:ServerRunning() && getbufvar(a:buffer, 'clangtools_opened', 0)
+    call setbufvar(a:buffer, 'clangtools_opened', 0)
+    call s:ServerRequest('close', {'filename': fnamemodify(bufname(a:buffer),
+          \ ':p')}, function('s:IgnoreResult'))
+  endif
+endfunction
+
+" The server runs clang in a separate process, so the editor never waits for
+" it. It's sent one JSON request per line, and its responses are handled by
+" callbacks as they arrive.
+let s:next_request_id = 1
+let s:pending_requests = {}
+
+function! s:ServerCommand()
+  let l:command = [g:clangtools_python, s:plugin_path . '/clang_server.py',
+        \ '--library-path', g:clangtools_library_path,
+        \ '--index-path', g:clangtools_index_path,
+        \ '--snapshot-path', g:clangtools_snapshot_path,
+        \ '--build-dir', g:clangtools_build_dir,
+        \ '--ast-cache-dir', g:clangtools_ast_cache_dir,
+        \ '--max-tus', string(g:clangtools_max_tus),
+        \ '--max-memory-mb', string(g:clangtools_max_memory_mb),
+        \ '--parse-threads', string(g:clangtools_parse_threads)]
+  if s:server_socket != ''
+    let l:command += ['--socket', s:server_socket]
+  endif
+  return l:command
+endfunction
+
+" Return the socket to reach the server on, or '' to run one over stdio. Every
+" editor on the same project shares a server if g:clangtools_share_server is
+" set.
+function! s:ServerSocket()
+  if g:clangtools_server_socket != '' || !g:clangtools_share_server
+    return g:clangtools_server_socket
+  endif
+  let l:root = g:clangtools_project_root
+  if l:root == ''
+    let l:root = g:clangtools_build_dir != '' ? g:clangtools_build_dir : getcwd()
+  endif
+  if exists('$XDG_RUNTIME_DIR')
+    let l:directory = $XDG_RUNTIME_DIR
+  else
+    " A directory only this user can use, which the server creates.
+    let l:directory = '/tmp/vim-clang-tools-' .
+          \ substitute(system('id -u'), '\n', '', 'g')
+  endif
+  let l:key = sha256($USER . "\n" . fnamemodify(l:root, ':p'))
+  return l:directory . '/vim-clang-tools-' . l:key[:15] . '.sock'
+endfunction
+
+" Return whether only this user can create a socket in the directory holding
+" one, so nobody else can be listening on it. A missing directory is created
+" by the server.
+function! s:PrivateSocketDirectory(socket)
+  let l:directory = fnamemodify(a:socket, ':p:h')
+  return !isdirectory(l:directory) || getfperm(l:directory) ==# 'rwx------'
+endfunction
+
+function! s:ServerRunning()
+  return exists('s:channel') && ch_status(s:channel) == 'open'
+endfunction
+
+function! s:ConnectServer()
+  try
+    let s:channel = ch_open('unix:' . s:server_socket,
+          \ {'mode': 'nl', 'callback': function('s:OnServerMessage')})
+  catch /^Vim\%((\a\+)\)\=:E902/
+    return 0
+  endtry
+  return s:ServerRunning()
+endfunction
+
+function! s:StartServer()
+  if s:ServerRunning()
     return 1
+  endif
+
+  let s:server_socket = s:ServerSocket()
+  if s:server_socket == ''
+    let l:job = job_start(s:ServerCommand(), {'mode': 'nl',
+          \ 'out_cb': function('s:OnServerMessage'), 'err_io': 'null'})
+    let s:channel = job_getchannel(l:job)
+  else
+    if !s:PrivateSocketDirectory(s:server_socket)
+      echoe 'clang_tools: Other users can write to the directory of '
+            \ . s:server_socket
+      return 0
+    endif
+    " Connect to a running server, or start one which outlives this editor.
+    if !s:ConnectServer()
+      call job_start(s:ServerCommand(), {'stoponexit': '', 'in_io': 'null',
+            \ 'out_io': 'null', 'err_io': 'null'})
+      for l:attempt in range(50)
+        sleep 100m
+        if s:ConnectServer()
+          break
+        endif
+      endfor
+    endif
+  endif
+
+  if !s:ServerRunning()
+    echoe 'clang_tools: Error starting the server.'
+    return 0
+  endif
+  return 1
+endfunction
+
+function! s:ServerRequest(method, params, callback)
+  if !s:ServerRunning()
+    return
+  endif
+  let l:id = s:next_request_id
+  let s:next_request_id += 1
+  let s:pending_requests[l:id] = a:callback
+  call ch_sendraw(s:channel, json_encode({'id': l:id, 'method': a:method,
+        \ 'params': a:params}) . "\n")
+endfunction
+
+function! s:OnServerMessage(channel, message)
+  let l:response = json_decode(a:message)
+  if type(l:response) != v:t_dict
+    return
+  endif
+  let l:id = get(l:response, 'id', v:null)
+  if type(l:id) == v:t_number && has_key(s:pending_requests, l:id)
+    let l:Callback = remove(s:pending_requests, l:id)
+  else
+    " Not the response to a pending request, such as the error for a line
+    " the server couldn't read.
+    let l:Callback = function('s:IgnoreResult')
+  endif
+  if has_key(l:response, 'error')
+    echom 'clang_tools: ' . l:response.error
+    return
+  endif
+  call l:Callback(l:response.result)
+endfunction
+
+function! s:IgnoreResult(result)
+endfunction
+
+" Return the buffer's contents if it's modified, or null if the file on disk
+" is up to date.
+function! s:BufferContents()
+  if !&modified
+    return v:null
+  endif
+  return join(getline(1, '$'), "\n")
+endfunction
+
+" Open the current buffer in the server the first time it's entered, and make
+" it the active one after that.
+function! s:ServerOpen()
+  if get(b:, 'clangtools_opened', 0)
+    call s:ServerChange()
+    call s:ServerRequest('activate', {'filename': expand('%:p')},
+          \ function('s:IgnoreResult'))
+    return
+  endif
+  let b:clangtools_opened = 1
+  let b:clangtools_sent_state = [b:changedtick, &modified]
+  call s:ServerRequest('open', {'filename': expand('%:p'),
+        \ 'contents': s:BufferContents()}, function('s:IgnoreResult'))
+endfunction
+
+function! s:ServerChange()
+  let l:state = [b:changedtick, &modified]
+  if get(b:, 'clangtools_sent_state', []) == l:state
+    return
+  endif
+  let b:clangtools_sent_state = l:state
+  call s:ServerRequest('change', {'filename': expand('%:p'),
+        \ 'contents': s:BufferContents()}, function('s:IgnoreResult'))
+endfunction
+
+function! s:OnDefinition(result)
+  if type(a:result) != v:t_dict
+    echom 'clang_tools: No definition found.'
+    return
+  endif
+  if a:result.filename != expand('%:p')
+    execute 'split ' . fnameescape(a:result.filename)
+  endif
+  call cursor(a:result.line, a:result.column)
+endfunction
+
+function! s:PrintStats(stats)
+  for l:name in sort(keys(a:stats))
+    echo l:name . ': ' . string(a:stats[l:name])
+  endfor
+endfunction
+
+" Print a dict of sizes in bytes, largest first.
+function! s:PrintSizes(sizes)
+  for l:name in sort(keys(a:sizes), {a, b -> a:sizes[b] - a:sizes[a]})
+    echo printf('%10.1f MB  %s', a:sizes[l:name] / 1048576.0, l:name)
+  endfor
+endfunction
+
+function! s:PrintMemoryUsage(usage)
+  call s:PrintSizes(a:usage.files)
+  for l:filename in a:usage.reparsing
+    echo printf('%13s  %s', 'reparsing', l:filename)
+  endfor
+  echo 'Total by kind:'
+  call s:PrintSizes(a:usage.kinds)
+  let l:total = 0
+  for l:amount in values(a:usage.kinds)
+    let l:total += l:amount
+  endfor
+  echo printf('%10.1f MB  total', l:total / 1048576.0)
+endfunction
+
+function! s:PrintLines(lines)
+  for l:line in a:lines
+    echo l:line
+  endfor
+endfunction
+
+" Return whether the Python script is loaded to answer requests in the editor.
+" Report an error if it isn't, such as when the server has stopped.
+function! s:PythonLoaded()
+  if exists('s:python_loaded')
+    return 1
+  endif
+  if get(g:, 'clangtools_use_server', 0)
+    echoe 'clang_tools: The server is not running.'
+  else
+    echoe 'clang_tools: Not loaded for this buffer.'
+  endif
+  return 0
 endfunction
 
 function! ClangToolsGoToDefinition()
+  if s:ServerRunning()
+    call s:ServerChange()
+    call s:ServerRequest('definition', {'filename': expand('%:p'),
+          \ 'line': line('.'), 'column': col('.')},
+          \ function('s:OnDefinition'))
+    return
+  endif
+  if !s:PythonLoaded()
+    return
+  endif
+
   let l:filename = expand('%:p')
   let l:line = line('.')
   let l:column = col('.')
@@ -41,4 +402,44 @@ function! ClangToolsGoToDefinition()
   call setpos('.', l:newpos)
 endfunction
 
+function! ClangToolsMemoryUsage()
+  if s:ServerRunning()
+    call s:ServerRequest('memory_usage', {}, function('s:PrintMemoryUsage'))
+    return
+  endif
+  if !s:PythonLoaded()
+    return
+  endif
+  py print_memory_usage()
+endfunction
+
+command! ClangToolsMemoryUsage call ClangToolsMemoryUsage()
+
+function! ClangToolsStats()
+  if s:ServerRunning()
+    call s:ServerRequest('stats', {}, function('s:PrintStats'))
+    return
+  endif
+  if !s:PythonLoaded()
+    return
+  endif
+  py print_stats()
+endfunction
+
+command! ClangToolsStats call ClangToolsStats()
+
+function! ClangToolsIncluders()
+  if s:ServerRunning()
+    call s:ServerRequest('includers', {'filename': expand('%:p')},
+          \ function('s:PrintLines'))
+    return
+  endif
+  if !s:PythonLoaded()
+    return
+  endif
+  py print_including_tus(vim.eval("expand('%:p')"))
+endfunction
+
+command! ClangToolsIncluders call ClangToolsIncluders()
+
 " vim: set ts=2 sts=2 sw=2 expandtab :    
@@ -1,9 +1,16 @@
 import clang.cindex as ci
 import os.path
 import vim
-from clang_tools import CrossTUIndex
+from clang_tools import ChangeTracker, create_index, file_mtime, location_of
+from reparse_scheduler import ReparseScheduler
 
 index = None
+scheduler = None
+changes = ChangeTracker()
+# The contents of modified buffers, with the b:changedtick they were read at.
+buffer_text = dict()
+# The (filename, contents) of the modified buffers found by the last scan.
+unsaved_buffers = []
 PRINT_DEBUG = False
 PRINT_WARNING = False
 
@@ -22,14 +29,38 @@ def print_warning(message):
     print(message)
 
 
+def get_option(name):
+    """Return the value of the g:clangtools_ option with the given name."""
+    return vim.eval('g:clangtools_' + name)
+
+
+def visible_files():
+    """Return the names of the current buffer and buffers in windows."""
+    files = [vim.current.buffer.name]
+    files.extend(w.buffer.name for w in vim.windows)
+    return files
+
+
 def init_clang_tools(library_path):
-    """Initialize libclang and tooling."""
+    """Initialize libclang and tooling.
+
+    The rest of the configuration is read from the g:clangtools_ options.
+    """
     if library_path != "" and not ci.Config.loaded:
         ci.Config.set_library_path(library_path)
 
-    global index
+    global index, scheduler
     try:
-        index = CrossTUIndex()
+        index = create_index(get_option('index_path'),
+                             get_option('snapshot_path'),
+                             get_option('build_dir'),
+                             get_option('ast_cache_dir'),
+                             int(get_option('max_tus')),
+                             int(get_option('max_memory_mb')),
+                             pinned=visible_files,
+                             parse_threads=int(get_option('parse_threads')))
+        scheduler = ReparseScheduler(
+            index, int(get_option('reparse_delay_ms')) / 1000.0)
     except Exception, e:
         print_warning('Failed to load libclang: {}'.format(str(e)))
         return 0
@@ -37,26 +68,139 @@ def init_clang_tools(library_path):
     return 1
 
 
-def reparse_all_tus():
-    """Reparse all translation units, using what's in vim's buffers."""
+def activate_buffer(filename):
+    """Give the translation unit of the buffer being edited a full AST."""
     global index
-    tus_to_reparse = []
+    index.set_active(filename)
+
+
+def buffer_contents(b, changedtick):
+    """Return the contents of a buffer as a string to pass to libclang.
+
+    The contents are cached until the buffer's b:changedtick changes.
+    """
+    global buffer_text
+    cached = buffer_text.get(b.name)
+    if cached is not None and cached[0] == changedtick:
+        return cached[1]
+    contents = '\n'.join(b[:len(b)])
+    if isinstance(contents, unicode):
+        contents = contents.encode('utf-8')
+    buffer_text[b.name] = (changedtick, contents)
+    return contents
+
+
+def scan_buffers():
+    """Find the buffers which changed since they were last checked.
+
+    A buffer has changed if its b:changedtick or the modification time of its
+    file differ from when it was last seen. Return the changed files, and the
+    (filename, contents) of the buffers modified relative to their files.
+    """
+    global changes
+    changed = []
     unsaved_files = []
     for b in vim.buffers:
         filename = b.name
+        if not filename:
+            continue
+        changedtick = int(vim.eval('getbufvar({}, "changedtick")'.format(
+            b.number)))
+        modified = int(vim.eval('getbufvar({}, "&modified")'.format(b.number)))
+        if changes.update(filename, (changedtick, file_mtime(filename)),
+                          modified):
+            changed.append(os.path.abspath(filename))
+        if modified:
+            unsaved_files.append((filename, buffer_contents(b, changedtick)))
+        else:
+            buffer_text.pop(filename, None)
+    return changed, unsaved_files
+
+
+def new_buffer_files():
+    """Return the files in buffers which have no translation unit yet."""
+    global index
+    new_files = []
+    for b in vim.buffers:
+        filename = b.name
+        if filename in index.tus or filename in index.evicted:
+            # Evicted translation units are loaded again when needed.
+            continue
+        _, ext = os.path.splitext(filename)
+        if ext[1:] in ['c', 'cpp', 'h', 'm', 'mm']:
+            new_files.append(filename)
+    return new_files
+
+
+def schedule_reparse(scan=True):
+    """Reparse the translation units affected by changes in the background.
+
+    This is called from a timer. The buffers are only scanned for changes if
+    scan is set, as the editor does when one changed since the last call.
+    Otherwise the unsaved files found by the last scan are used. Return
+    whether there's more to do, in which case it should be called again.
+    """
+    global index, scheduler, unsaved_buffers
+    if scan:
+        index.parse_tus(new_buffer_files(), timeout=0)
+        changed, unsaved_buffers = scan_buffers()
+        for filename in changed:
+            scheduler.file_changed(filename)
+    return int(scheduler.run(unsaved_buffers))
+
+
+def reparse_all_tus():
+    """Bring the translation units up to date with vim's buffers.
+
+    Usually the scheduler has already reparsed them. Anything it hasn't is
+    reparsed now.
+    """
+    global index, scheduler, unsaved_buffers
+    # Anything unfinished by the deadline is applied when it's needed.
+    timeout = None
+    if int(get_option('parse_timeout_ms')) > 0:
+        timeout = int(get_option('parse_timeout_ms')) / 1000.0
+    index.parse_tus(new_buffer_files(), timeout)
+    changed, unsaved_buffers = scan_buffers()
+    for filename in changed:
+        scheduler.file_changed(filename)
+    scheduler.flush()
+    scheduler.run(unsaved_buffers)
+    index.finish_jobs(timeout)
+
+
+def print_memory_usage():
+    """Print the memory used by each translation unit, heaviest first."""
+    global index
+    usage = index.memory_usage()
+    totals = dict((filename, sum(kinds.itervalues()))
+                  for filename, kinds in usage.iteritems())
+    for filename in sorted(totals, key=totals.get, reverse=True):
+        print('{:>10.1f} MB  {}'.format(totals[filename] / 1048576.0,
+                                        filename))
+    for filename in sorted(index.jobs):
+        print('{:>13}  {}'.format('reparsing', filename))
+
+    print('Total by kind:')
+    kinds = index.total_memory_usage()
+    for kind in sorted(kinds, key=kinds.get, reverse=True):
+        print('{:>10.1f} MB  {}'.format(kinds[kind] / 1048576.0, kind))
+    print('{:>10.1f} MB  total'.format(sum(kinds.itervalues()) / 1048576.0))
+
+
+def print_including_tus(filename):
+    """Print the translation units which include a file."""
+    global index
+    for tu in sorted(index.including_tus(filename)):
+        print(tu)
 
-        try:
-            tu = index.tus[filename]
-            tus_to_reparse.append(tu)
-            unsaved_files.append((filename, '\n'.join(b[:len(b)])))
-        except KeyError:
-            _, ext = os.path.splitext(filename)
-            print_debug('parse_tu {} {}'.format(filename, ext))
-            if ext[1:] in ['c', 'cpp', 'h', 'm', 'mm']:
-                index.parse_tu(filename)
 
-    for tu in tus_to_reparse:
-        tu.reparse(unsaved_files)
+def print_stats():
+    """Print statistics about the index."""
+    global index
+    stats = index.stats()
+    for name in sorted(stats):
+        print('{}: {}'.format(name, stats[name]))
 
 
 def go_to_definition(filename, line, col):
@@ -68,7 +212,6 @@ def go_to_definition(filename, line, col):
     col = int(col)
     print_debug('go_to_definition {}: {}, {}'.format(filename, line, col))
 
-    # This should happen asynchronously as files are changed.
     reparse_all_tus()
 
     global index
@@ -78,11 +221,10 @@ def go_to_definition(filename, line, col):
         print_debug(index.tus)
         return [line, col]
 
-    target_loc = ref.location
-    print_debug(target_loc)
-    target_file = target_loc.file.name
+    target_file, target_line, target_col = location_of(ref)
+    print_debug((target_file, target_line, target_col))
 
     if not os.path.samefile(filename, target_file):
         vim.command(':split {}'.format(target_file))
 
-    return [target_loc.line, target_loc.column]
+    return [target_line, target_col]